@@ -18,4 +18,26 @@ app.conf.beat_schedule = {
         'schedule': 30.0,
         'args': ()
     },
+    # safety net - flushes are scheduled on save, this picks up anything left behind
+    'search-index-flush-cron-60s': {
+        'task': 'products.tasks.flush_search_index',
+        'schedule': 60.0,
+        'args': ()
+    },
+    # safety net - flushes are scheduled on order creation
+    'order-confirmation-flush-cron-60s': {
+        'task': 'orders.tasks.flush_order_confirmations',
+        'schedule': 60.0,
+        'args': ()
+    },
+    'daily-sales-rollup-cron-1h': {
+        'task': 'orders.tasks.rollup_daily_sales',
+        'schedule': 60 * 60.0,
+        'args': ()
+    },
+    'order-totals-check-cron-24h': {
+        'task': 'orders.tasks.check_order_totals',
+        'schedule': 24 * 60 * 60.0,
+        'args': ()
+    },
 }
@@ -0,0 +1,104 @@
+"""
+Redis work queues shared by the search index queue (products.indexing) and the order confirmation queue (orders.mailing).
+
+A queue is a sorted set of ids scored by the time they were first queued - queuing an id again before
+it is popped does not add a second entry, and the score of the oldest entry gives the queue lag.
+Consumers pop batches and put back what they could not process, with the original scores.
+"""
+import time
+
+import redis
+from django.conf import settings
+
+
+_connection = None
+
+
+def get_connection():
+    global _connection
+    if _connection is None:
+        _connection = redis.Redis.from_url(settings.REDIS_URL)
+    return _connection
+
+
+class Queue:
+
+    def __init__(self, key, flush_scheduled_key):
+        self.key = key
+        # set while a flush task is scheduled, shared by queues flushed by the same task
+        self.flush_scheduled_key = flush_scheduled_key
+
+    def enqueue(self, ids, flush_timeout):
+        """
+        Queues the ids. Returns True if a flush should be scheduled - no flush was scheduled
+        in the last `flush_timeout` seconds, or the scheduled one already started.
+        """
+        conn = get_connection()
+        now = time.time()
+        # nx - keep the time the id was first queued, so lag covers its whole wait
+        conn.zadd(self.key, {pk: now for pk in ids}, nx=True)
+        return bool(conn.set(self.flush_scheduled_key, now, nx=True, ex=flush_timeout))
+
+    def start_flush(self):
+        # ids queued from now on must schedule another flush
+        get_connection().delete(self.flush_scheduled_key)
+
+    def pop(self, count):
+        """
+        Pops the `count` oldest ids as `{id: score}`, oldest first.
+        """
+        return {int(pk): score for pk, score in get_connection().zpopmin(self.key, count)}
+
+    def requeue(self, scores):
+        """
+        Puts popped ids back with their original scores.
+        """
+        if scores:
+            get_connection().zadd(self.key, scores, nx=True)
+
+    def get_stats(self):
+        """
+        Returns the number of queued ids and the age in seconds of the oldest one (queue lag).
+        """
+        conn = get_connection()
+        oldest = conn.zrange(self.key, 0, 0, withscores=True)
+        return {
+            'depth': conn.zcard(self.key),
+            'lag': time.time() - oldest[0][1] if oldest else 0.0,
+        }
+
+
+class RateLimiter:
+    """
+    Spaces actions of all workers at most `rate` per second - a token bucket holding one token,
+    refilled `rate` times per second, kept in Redis (the time the next token is available).
+    """
+
+    def __init__(self, key, rate):
+        self.key = key
+        self.interval = 1 / rate
+
+    def reserve(self):
+        """
+        Takes the next token. Returns the seconds to wait until it is available.
+        """
+        with get_connection().pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self.key)
+                    # server time - the same clock for all workers
+                    seconds, microseconds = pipe.time()
+                    now = seconds + microseconds / 1e6
+                    available = max(float(pipe.get(self.key) or 0), now)
+                    pipe.multi()
+                    pipe.set(self.key, available + self.interval, px=int((available - now + self.interval) * 1000) + 1000)
+                    pipe.execute()
+                    return available - now
+                except redis.WatchError:
+                    # taken by another worker meanwhile
+                    continue
+
+    def wait(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
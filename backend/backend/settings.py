@@ -65,9 +65,15 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Stateless JWT authentication - the user is built from the access token claims, without a database lookup
+# (see users.authentication). Changes of user groups and names apply to tokens obtained afterwards,
+# deactivated users keep access until their access token expires - hence the short ACCESS_TOKEN_LIFETIME.
+JWT_STATELESS_AUTH = os_getenv('JWT_STATELESS_AUTH') == 'True'
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.JWTClaimsAuthentication' if JWT_STATELESS_AUTH
+        else 'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': 10,
@@ -78,7 +84,7 @@ REST_FRAMEWORK = {
 }
 
 SIMPLE_JWT = {
-'ACCESS_TOKEN_LIFETIME': timedelta(days=10),
+'ACCESS_TOKEN_LIFETIME': timedelta(minutes=5) if JWT_STATELESS_AUTH else timedelta(days=10),
 'REFRESH_TOKEN_LIFETIME': timedelta(days=20),
 'ROTATE_REFRESH_TOKENS': False,
 'BLACKLIST_AFTER_ROTATION': True,
@@ -97,7 +103,16 @@ SIMPLE_JWT = {
 'TOKEN_TYPE_CLAIM': 'token_type',
 
 'JTI_CLAIM': 'jti',
-'TOKEN_USER_CLASS': 'rest_framework_simplejwt.models.TokenUser'
+'TOKEN_USER_CLASS': 'rest_framework_simplejwt.models.TokenUser',
+# user claims for the stateless authentication mode only
+'TOKEN_OBTAIN_SERIALIZER': (
+    'users.serializers.ClaimsTokenObtainPairSerializer' if JWT_STATELESS_AUTH
+    else 'rest_framework_simplejwt.serializers.TokenObtainPairSerializer'
+),
+'TOKEN_REFRESH_SERIALIZER': (
+    'users.serializers.ClaimsTokenRefreshSerializer' if JWT_STATELESS_AUTH
+    else 'rest_framework_simplejwt.serializers.TokenRefreshSerializer'
+),
 }
 
 ROOT_URLCONF = 'backend.urls'
@@ -210,6 +225,19 @@ THUMBNAILS = {
 }
 
 
+# Product photo thumbnails - generated by a Celery worker after the product is saved (see products.images)
+PRODUCT_THUMBNAILS = {
+    # set PRODUCT_THUMBNAILS_ASYNC=False to generate them in the request, without a worker
+    'ASYNC': os_getenv('PRODUCT_THUMBNAILS_ASYNC', 'True') == 'True',
+    'SIZES': ['small'],
+    # responsive variants (ProductSerializer.srcset), see products.variants
+    'VARIANT_WIDTHS': [200, 400, 800],
+    # saved next to the photo format - avif needs Pillow >= 11 or pillow-avif-plugin, skipped otherwise
+    'VARIANT_FORMATS': ['webp', 'avif'],
+    'QUALITY': 80,
+}
+
+
 # Redis settings - need refactor as I opted for only-docker builds
 
 REDIS_HOST = os_getenv('REDIS_HOST', '127.0.0.1')
@@ -230,6 +258,43 @@ REDIS_DB = REDIS_DB_KEYS.get(os_getenv('ENV'))
 REDIS_URL = f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}'
 
 
+# Cache settings - set LOCAL_CACHE=True to keep the cache in local memory, without Redis
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+        'KEY_PREFIX': 'cache',
+    } if os_getenv('LOCAL_CACHE') != 'True' else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+CATALOG_CACHE = {
+    # seconds to keep product and category responses - catalog writes invalidate them sooner
+    'TIMEOUT': 60 * 60,
+}
+CATALOG_PAGINATION = {
+    # rows from which `count=approximate` takes the pg_class estimate instead of counting
+    'APPROXIMATE_COUNT_MIN': 100000,
+}
+CATALOG_EXPORT = {
+    # products per server-side cursor fetch and per serialized chunk
+    'CHUNK_SIZE': 2000,
+    # seconds the X-Updated-Until boundary lies before the export started - longer than any catalog transaction
+    'OVERLAP': 60,
+}
+USER_GROUPS_CACHE = {
+    # seconds to keep group names used by permission checks - group changes invalidate them sooner
+    'TIMEOUT': 60 * 60,
+}
+TOP_SELLERS_CACHE = {
+    # seconds to keep reports of ranges that ended before yesterday - their orders do not change
+    'CLOSED_TIMEOUT': 60 * 60 * 24 * 7,
+    # seconds to keep reports of ranges that include today or yesterday - new orders invalidate them sooner
+    'OPEN_TIMEOUT': 60 * 5,
+}
+
+
 # Celery settings
 
 CELERY_BROKER_URL = REDIS_URL
@@ -249,6 +314,42 @@ ELASTICSEARCH_DSL={
     }
 }
 
+# Index documents from a Celery worker in batches instead of in the request thread (see products.indexing)
+ELASTICSEARCH_DSL_SIGNAL_PROCESSOR = 'products.signals.QueuedSignalProcessor'
+SEARCH_INDEX_QUEUE = {
+    # set SEARCH_INDEX_QUEUE_ENABLED=False to index in the request, without a worker
+    'ENABLED': os_getenv('SEARCH_INDEX_QUEUE_ENABLED', 'True') == 'True',
+    'BATCH_SIZE': 500,
+    # seconds to wait for more saves before flushing
+    'COUNTDOWN': 2,
+    # seconds before another flush is scheduled if the scheduled one did not start
+    'FLUSH_TIMEOUT': 60,
+}
+
+# Payment remainder settings (orders.tasks.send_payment_remainder_mail)
+PAYMENT_REMAINDER = {
+    # orders claimed and sent by one chunk task, through one SMTP connection
+    'BATCH_SIZE': 500,
+    # failed sends of an order before it is skipped
+    'MAX_ATTEMPTS': 5,
+    # seconds before orders claimed by a chunk task that did not finish can be claimed again
+    'CLAIM_TIMEOUT': 10 * 60,
+}
+
+# Order confirmation emails - queued and sent in batches by a Celery worker (see orders.mailing)
+ORDER_CONFIRMATION_MAIL = {
+    # set ORDER_CONFIRMATION_MAIL_ENABLED=False to send them in the request, without a worker
+    'ENABLED': os_getenv('ORDER_CONFIRMATION_MAIL_ENABLED', 'True') == 'True',
+    # confirmations sent through one SMTP connection
+    'BATCH_SIZE': 100,
+    # messages per second
+    'RATE': 10,
+    # seconds to wait for more orders before flushing
+    'COUNTDOWN': 5,
+    # seconds before another flush is scheduled if the scheduled one did not start
+    'FLUSH_TIMEOUT': 60,
+}
+
 # SMTP Settings
 
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
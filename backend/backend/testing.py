@@ -0,0 +1,15 @@
+"""
+Settings shared by the test suites.
+"""
+from django.conf import settings
+from django.test import override_settings
+
+
+# generate thumbnails, index and send confirmations in the test process and keep the cache in local memory,
+# so tests need neither a Celery worker nor Redis
+local_settings = override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    PRODUCT_THUMBNAILS={**settings.PRODUCT_THUMBNAILS, 'ASYNC': False},
+    SEARCH_INDEX_QUEUE={**settings.SEARCH_INDEX_QUEUE, 'ENABLED': False},
+    ORDER_CONFIRMATION_MAIL={**settings.ORDER_CONFIRMATION_MAIL, 'ENABLED': False},
+)
@@ -8,9 +8,15 @@ class OrderAdmin(admin.ModelAdmin):
                 'client',
                 'remainder_sent',
                 'remainder_force',
-                'order_total'
+                'order_total',
+                'line_count'
             )
-    
+
+    # stored total, computed for orders not backfilled yet (see backfill_order_totals)
+    @admin.display(description='Order total', ordering='total')
+    def order_total(self, obj):
+        return obj.order_total
+
 
 class OrderDataAdmin(admin.ModelAdmin):
     list_display = (
@@ -0,0 +1,34 @@
+"""
+Cache of top-sellers reports.
+
+Reports are keyed by their normalized parameters (products limit, first day, day after the last day).
+Ranges that ended before yesterday (in TIME_ZONE) are closed - their orders do not change, so they are kept
+for `CLOSED_TIMEOUT`. Keys of other ranges carry a version that every new order increments,
+so a new order invalidates all of them at once. Ranges that ended yesterday are not closed yet, as orders
+created before midnight may commit after it (like the one-day overlap of rollup_daily_sales).
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+
+KEY = 'top_sellers:{}:{}:{}:{}'
+VERSION_KEY = 'top_sellers:version'
+
+
+def get_key(products_max, day_from, day_to):
+    """
+    Returns the cache key and timeout of a report of the days in [day_from, day_to).
+    """
+    if day_to < timezone.localdate():
+        return KEY.format(products_max, day_from, day_to, 'closed'), settings.TOP_SELLERS_CACHE['CLOSED_TIMEOUT']
+    version = cache.get_or_set(VERSION_KEY, 0, timeout=None)
+    return KEY.format(products_max, day_from, day_to, version), settings.TOP_SELLERS_CACHE['OPEN_TIMEOUT']
+
+
+def invalidate():
+    """
+    Invalidates reports of ranges that include today or yesterday.
+    """
+    cache.add(VERSION_KEY, 0, timeout=None)
+    cache.incr(VERSION_KEY)
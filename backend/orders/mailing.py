@@ -0,0 +1,128 @@
+"""
+Queue of order confirmation emails.
+
+Created orders are stored as order ids in a Redis sorted set, scored by the time they were queued.
+`flush()` pops the queued ids in batches and sends each batch through one SMTP connection,
+at most `ORDER_CONFIRMATION_MAIL['RATE']` messages per second across all workers (see backend.queues.RateLimiter).
+A transient SMTP error (4xx reply, dropped connection) puts the unsent part of the batch back in the queue
+before it is raised, so the flush can be retried. Permanently rejected messages are counted and dropped.
+"""
+import time
+from contextlib import suppress
+from smtplib import SMTPException, SMTPResponseException, SMTPServerDisconnected
+
+from django.conf import settings
+from django.core import mail
+from django.core.mail import BadHeaderError, EmailMessage
+
+from backend.queues import Queue, RateLimiter
+
+from .models import Order
+
+
+QUEUE_KEY = 'order_confirmation:queue'
+FLUSH_SCHEDULED_KEY = 'order_confirmation:flush_scheduled'
+RATE_KEY = 'order_confirmation:next_send'
+
+queue = Queue(QUEUE_KEY, FLUSH_SCHEDULED_KEY)
+
+
+def enqueue(order_ids):
+    """
+    Queues confirmations of the given orders. Returns True if a flush should be scheduled.
+    """
+    return queue.enqueue(order_ids, settings.ORDER_CONFIRMATION_MAIL['FLUSH_TIMEOUT'])
+
+
+def get_queue_stats():
+    """
+    Returns the number of queued confirmations and the age in seconds of the oldest one (queue lag).
+    """
+    return queue.get_stats()
+
+
+def is_transient(error):
+    if isinstance(error, SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, SMTPException):
+        return isinstance(error, SMTPServerDisconnected)
+    # socket errors
+    return isinstance(error, OSError)
+
+
+def send(orders, rate_limiter=None):
+    """
+    Sends confirmations of the given orders (with clients loaded) through one SMTP connection,
+    waiting for `rate_limiter` (a RateLimiter) before each message.
+
+    Stops at the first transient error - the failed order and the ones after it are not sent.
+    Returns the ids of orders with sent and with permanently failed confirmations,
+    the transient error (or None) and the total send time in seconds.
+    """
+    sent, failed, error, send_time = [], [], None, 0.0
+    connection = mail.get_connection(fail_silently=False)
+    try:
+        for order in orders:
+            if rate_limiter is not None:
+                rate_limiter.wait()
+            started = time.monotonic()
+            message = EmailMessage(
+                subject='Order confirmation',
+                body=f'Order created at: {order.created_at.strftime("%Y-%m-%d %H:%M")}',
+                from_email=settings.EMAIL_DEFAULT_FROM,
+                to=[order.client.email],
+                connection=connection,
+            )
+            try:
+                message.send()
+            except (BadHeaderError, SMTPException, OSError) as e:
+                if is_transient(e):
+                    error = e
+                    break
+                failed.append(order.pk)
+            else:
+                sent.append(order.pk)
+            send_time += time.monotonic() - started
+    finally:
+        with suppress(SMTPException, OSError):
+            connection.close()
+    return sent, failed, error, send_time
+
+
+def flush(batch_size=None):
+    """
+    Sends all queued confirmations, `batch_size` per SMTP connection.
+
+    On a transient SMTP error the unsent confirmations of the batch are put back in the queue
+    with their original scores before the error is raised.
+    Returns the number of sent and failed confirmations, the highest queue lag seen
+    and the average send latency in seconds.
+    """
+    batch_size = batch_size or settings.ORDER_CONFIRMATION_MAIL['BATCH_SIZE']
+    rate_limiter = RateLimiter(RATE_KEY, settings.ORDER_CONFIRMATION_MAIL['RATE'])
+    queue.start_flush()
+    sent_count, failed_count, max_lag, send_time = 0, 0, 0.0, 0.0
+    while batch := queue.pop(batch_size):
+        try:
+            # deleted orders are dropped
+            orders = list(
+                Order.objects
+                .filter(pk__in=batch)
+                .select_related('client')
+                .only('created_at', 'client__email')
+                .order_by('pk')
+            )
+            sent, failed, error, batch_send_time = send(orders, rate_limiter)
+        except Exception:
+            queue.requeue(batch)
+            raise
+        if error is not None:
+            done = set(sent) | set(failed)
+            queue.requeue({pk: score for pk, score in batch.items() if pk not in done})
+            raise error
+        sent_count += len(sent)
+        failed_count += len(failed)
+        send_time += batch_send_time
+        max_lag = max(max_lag, time.time() - min(batch.values()))
+    latency = send_time / (sent_count + failed_count) if sent_count + failed_count else 0.0
+    return sent_count, failed_count, max_lag, latency
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from orders.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Stores totals and line counts of orders created before they were persisted, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Orders updated per transaction.')
+        parser.add_argument('--all', action='store_true', help='Recompute all orders, not only the missing totals.')
+
+    def handle(self, *args, **options):
+        orders = Order.objects.all() if options['all'] else Order.objects.filter(total__isnull=True)
+        last_pk = 0
+        updated = 0
+        # keyset over pk - every batch is an index range scan, however far the backfill is
+        while pks := list(
+            orders.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:options['batch_size']]
+        ):
+            with transaction.atomic():
+                updated += Order.objects.filter(pk__in=pks).update_totals()
+            last_pk = pks[-1]
+            self.stdout.write(f'{updated} orders updated (last id: {last_pk})')
+        self.stdout.write(self.style.SUCCESS(f'Done, {updated} orders updated.'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from orders.models import Order, ProductDailySales, ProductDailySalesRollup
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the daily product sales rollup from the order lines of all closed days.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-days', type=int, default=31, help='Days rolled up per transaction.')
+
+    def handle(self, *args, **options):
+        first_order = Order.objects.order_by('created_at').values_list('created_at', flat=True).first()
+        with transaction.atomic():
+            ProductDailySales.objects.all().delete()
+            ProductDailySalesRollup.objects.all().delete()
+        if first_order is None:
+            self.stdout.write(self.style.SUCCESS('Done, no orders.'))
+            return
+        day_from, day_to = timezone.localdate(first_order), timezone.localdate()
+        rows = ProductDailySales.objects.rollup(day_from, day_to, batch_days=options['batch_days'])
+        self.stdout.write(self.style.SUCCESS(f'Done, {rows} rows stored for {day_from} - {day_to}.'))
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.1 on 2026-10-18 04:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0002_order_total'),
+        ('products', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at'], name='order_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderdata',
+            index=models.Index(fields=['order', 'product'], include=('quantity',), name='orderdata_order_product_idx'),
+        ),
+        # drop the order_id index only once the composite index covers it
+        migrations.AlterField(
+            model_name='orderdata',
+            name='order',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='order_data', to='orders.order'),
+        ),
+    ]
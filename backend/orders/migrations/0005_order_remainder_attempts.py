@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 04:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_product_daily_sales'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='remainder_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
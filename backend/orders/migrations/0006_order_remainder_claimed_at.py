@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 04:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_order_remainder_attempts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='remainder_claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.1 on 2026-10-18 04:27
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_order_remainder_claimed_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('remainder_sent', False)), fields=['payment_deadline'], name='order_remainder_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('remainder_force', True)), fields=['id'], name='order_remainder_forced_idx'),
+        ),
+    ]
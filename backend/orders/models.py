@@ -1,10 +1,67 @@
-from django.db import models
-from django.db.models import F, Sum, Value
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Count, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from products.models import Product
 
+from .utils import day_start
+
 User = get_user_model()
 
+
+class OrderQuerySet(models.QuerySet):
+
+    def with_order_total(self):
+        """
+        Computes order totals in the same query, see Order.order_total.
+        """
+        return self.annotate(
+            annotated_order_total=Sum(F('order_data__product_price') * F('order_data__quantity'))
+        )
+
+    def with_computed_totals(self):
+        """
+        Computes order totals and line counts from the order lines, to be compared with the stored ones.
+        """
+        return self.annotate(
+            computed_total=Coalesce(
+                Sum(F('order_data__product_price') * F('order_data__quantity')),
+                Value(0),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2)
+            ),
+            computed_line_count=Count('order_data'),
+        )
+
+    def remainder_due(self):
+        """
+        Orders waiting for a payment remainder (see orders.tasks.send_payment_remainder_mail),
+        not claimed by a running dispatch.
+        """
+        # deadline until the end of tomorrow in TIME_ZONE - compares the raw column, so the partial indexes are used
+        notify_before = day_start(timezone.localdate() + timedelta(days=2))
+        claim_expired = timezone.now() - timedelta(seconds=settings.PAYMENT_REMAINDER['CLAIM_TIMEOUT'])
+        return self.filter(
+            Q(remainder_sent=False, payment_deadline__lt=notify_before) | Q(remainder_force=True),
+            Q(remainder_claimed_at__isnull=True) | Q(remainder_claimed_at__lt=claim_expired),
+            remainder_attempts__lt=settings.PAYMENT_REMAINDER['MAX_ATTEMPTS'],
+        )
+
+    def update_totals(self):
+        """
+        Recomputes the stored total and line_count of the orders with one aggregate query and one update.
+        Returns the number of updated orders.
+        """
+        orders = [
+            Order(pk=order.pk, total=order.computed_total, line_count=order.computed_line_count)
+            for order in self.order_by().with_computed_totals().only('pk')
+        ]
+        return Order.objects.bulk_update(orders, ['total', 'line_count'])
+
+
 class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     client = models.ForeignKey(User, on_delete=models.PROTECT)
@@ -21,10 +78,35 @@ class Order(models.Model):
     payment_deadline = models.DateTimeField()
     remainder_sent = models.BooleanField(default=False)
     remainder_force = models.BooleanField(default=False)
+    # failed remainder sends - retried by the next runs up to PAYMENT_REMAINDER['MAX_ATTEMPTS']
+    remainder_attempts = models.PositiveSmallIntegerField(default=0)
+    # set while a remainder chunk task is sending the order's remainder
+    remainder_claimed_at = models.DateTimeField(null=True, blank=True)
+    # dispatch that claimed the order - a chunk only sends the orders still claimed by its own dispatch
+    remainder_claim_token = models.UUIDField(null=True, blank=True)
+    # denormalized from order lines when the order is created, empty until backfilled (backfill_order_totals)
+    total = models.DecimalField(max_digits=12, decimal_places=2, null=True)
+    line_count = models.PositiveIntegerField(null=True)
 
+    objects = OrderQuerySet.as_manager()
 
+    class Meta:
+        indexes = [
+            # date range reports (top sellers)
+            models.Index(fields=['created_at'], name='order_created_at_idx'),
+            # payment remainders (Order.objects.remainder_due) - only pending and forced orders are indexed,
+            # so selecting them does not depend on the number of past orders
+            models.Index(fields=['payment_deadline'], name='order_remainder_pending_idx', condition=Q(remainder_sent=False)),
+            models.Index(fields=['id'], name='order_remainder_forced_idx', condition=Q(remainder_force=True)),
+        ]
+
+    # stored total, or the with_order_total() annotation if present, otherwise costs an aggregate query
     @property
     def order_total(self) -> float:
+        if self.total is not None:
+            return self.total
+        if hasattr(self, 'annotated_order_total'):
+            return self.annotated_order_total
         ot = (self.order_data
               .values('product_price','quantity')
               .aggregate(order_total=Sum(F('product_price') * F('quantity'))))
@@ -34,7 +116,77 @@ class Order(models.Model):
 
 
 class OrderData(models.Model):
-    order = models.ForeignKey(Order, related_name='order_data', on_delete=models.CASCADE)
+    # indexed by orderdata_order_product_idx
+    order = models.ForeignKey(Order, related_name='order_data', on_delete=models.CASCADE, db_index=False)
     product = models.ForeignKey(Product, on_delete=models.PROTECT)
     quantity = models.PositiveSmallIntegerField()
-    product_price = models.DecimalField(max_digits=9, decimal_places=2)
\ No newline at end of file
+    product_price = models.DecimalField(max_digits=9, decimal_places=2)
+
+    class Meta:
+        indexes = [
+            # order lines lookups and per product reports - quantity included for index-only scans
+            models.Index(fields=['order', 'product'], include=['quantity'], name='orderdata_order_product_idx'),
+        ]
+
+class ProductDailySalesQuerySet(models.QuerySet):
+
+    def rollup(self, day_from, day_to, batch_days=31):
+        """
+        Replaces the rollup of days in [day_from, day_to) with sums computed from the order lines,
+        `batch_days` days per transaction. The rollup watermark moves after each batch.
+        Returns the number of stored rows.
+        """
+        stored = 0
+        while day_from < day_to:
+            batch_to = min(day_from + timedelta(days=batch_days), day_to)
+            lines = (OrderData.objects
+                     .filter(order__created_at__gte=day_start(day_from), order__created_at__lt=day_start(batch_to))
+                     .annotate(day=TruncDate('order__created_at'))
+                     .values('product', 'day')
+                     .annotate(sold=Sum('quantity'), revenue=Sum(F('product_price') * F('quantity')))
+                     .order_by())
+            with transaction.atomic():
+                self.filter(day__gte=day_from, day__lt=batch_to).delete()
+                stored += len(self.bulk_create([
+                    ProductDailySales(
+                        product_id=line['product'],
+                        day=line['day'],
+                        quantity=line['sold'],
+                        revenue=line['revenue']
+                    )
+                    for line in lines
+                ], batch_size=1000))
+                ProductDailySalesRollup.objects.update_or_create(pk=1, defaults={'day_to': batch_to})
+            day_from = batch_to
+        return stored
+
+
+class ProductDailySales(models.Model):
+    """
+    Products sold per day (in TIME_ZONE) - top sellers reports sum these instead of all order lines.
+    Days before ProductDailySalesRollup.day_to are rolled up, see orders.tasks.rollup_daily_sales.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    day = models.DateField()
+    quantity = models.PositiveIntegerField()
+    revenue = models.DecimalField(max_digits=14, decimal_places=2)
+
+    objects = ProductDailySalesQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # day first - reports scan day ranges
+            models.UniqueConstraint(fields=['day', 'product'], name='productdailysales_day_product_uniq'),
+        ]
+
+
+class ProductDailySalesRollup(models.Model):
+    """
+    Single row - ProductDailySales holds every day before `day_to`, later days are read from the order lines.
+    """
+    day_to = models.DateField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def get_day_to(cls):
+        return cls.objects.filter(pk=1).values_list('day_to', flat=True).first()
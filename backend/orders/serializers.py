@@ -1,14 +1,54 @@
 from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import transaction
 from rest_framework import serializers
 
+from products.models import Product
+
+from . import cache as top_sellers_cache
+from . import mailing
 from .models import Order, OrderData
-from .tasks import send_order_confirmation_mail
+from .tasks import flush_order_confirmations
+
+
+class OrderProductField(serializers.PrimaryKeyRelatedField):
+    """
+    Product primary key field that resolves products fetched for the whole order by OrderDataListSerializer.
+    """
+
+    def to_internal_value(self, data):
+        products = getattr(self.parent, 'products', None)
+        if products is None:
+            return super().to_internal_value(data)
+        try:
+            return products[int(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+class OrderDataListSerializer(serializers.ListSerializer):
+
+    # fetch all products of the order in one query instead of one per line
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            pks = set()
+            for item in data:
+                try:
+                    pks.add(int(item['product']))
+                except (KeyError, TypeError, ValueError):
+                    continue
+            self.child.products = Product.objects.in_bulk(pks)
+        return super().to_internal_value(data)
 
 
 class OrderDataSerializer(serializers.ModelSerializer):
+    product = OrderProductField(queryset=Product.objects.all())
 
     class Meta:
         model = OrderData
+        list_serializer_class = OrderDataListSerializer
         fields = ['product', 'quantity', 'product_price']
         read_only_fields = ['product_price',]
 
@@ -45,12 +85,29 @@ class OrderSerializer(serializers.ModelSerializer):
         order_items = validated_data.pop('order_data')
         # after updating to Django 5.1 we can use model generated field (see models.Order)
         pd = datetime.now() + timedelta(days=5)
-        order = Order.objects.create(payment_deadline=pd, **validated_data)
-        for item in order_items:
-            OrderData.objects.create(order=order, product_price=item['product'].price, **item)
-        send_order_confirmation_mail.delay(order.client.email, order.created_at)
+        total = sum(item['product'].price * item['quantity'] for item in order_items)
+        with transaction.atomic():
+            order = Order.objects.create(
+                payment_deadline=pd,
+                total=total,
+                line_count=len(order_items),
+                **validated_data
+            )
+            OrderData.objects.bulk_create([
+                OrderData(order=order, product_price=item['product'].price, **item)
+                for item in order_items
+            ])
+        top_sellers_cache.invalidate()
+        self.queue_confirmation(order)
         return order
 
+    def queue_confirmation(self, order):
+        if not settings.ORDER_CONFIRMATION_MAIL['ENABLED']:
+            mailing.send([order])
+            return
+        if mailing.enqueue([order.pk]):
+            flush_order_confirmations.apply_async(countdown=settings.ORDER_CONFIRMATION_MAIL['COUNTDOWN'])
+
 
 
 class TopSellers(serializers.ModelSerializer):
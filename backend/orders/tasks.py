@@ -1,14 +1,44 @@
 from celery import shared_task
+from contextlib import suppress
 from smtplib import SMTPException
 import datetime
-from django.core.mail import BadHeaderError, send_mail
+import uuid
+from django.core.mail import BadHeaderError, EmailMessage, get_connection, send_mail
 from django.conf import settings
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
 
+from . import mailing
+from .models import Order, ProductDailySales, ProductDailySalesRollup
 
-from .models import Order
+
+@shared_task(bind=True, max_retries=5)
+def flush_order_confirmations(self):
+    """
+    Sends the order confirmation emails queued by `OrderSerializer`, in batches over one SMTP connection each (see orders.mailing).
+
+    On a transient SMTP error the unsent confirmations are put back in the queue and the task is retried with exponential backoff.
+
+    Args:
+        self (celery.Task): The Celery task instance.
+
+    Returns:
+        str: The number of sent and rejected confirmations, the queue lag (time the oldest of them had waited),
+            the average send latency and the number of confirmations left in the queue.
+    """
+    try:
+        sent, failed, lag, latency = mailing.flush()
+    except (SMTPException, OSError) as e:
+        raise self.retry(exc=e, countdown=2 ** self.request.retries)
+    depth = mailing.get_queue_stats()['depth']
+    return (
+        f'{sent} confirmations sent, {failed} rejected, queue lag {lag:.1f}s, '
+        f'send latency {latency * 1000:.0f}ms, queue depth {depth}'
+    )
 
 
+# kept for confirmation tasks queued before confirmations were batched, see flush_order_confirmations
 @shared_task(bind=True)
 def send_order_confirmation_mail(self, target_mail, created_at):
     """
@@ -43,60 +73,201 @@ def send_order_confirmation_mail(self, target_mail, created_at):
 
 
 
+def send_remainders(orders):
+    """
+    Sends payment remainders of the given orders (with clients loaded) through one SMTP connection.
+
+    A failed message does not stop the batch - the connection is reopened for the next message.
+
+    Args:
+        orders (list): Orders with `client` selected.
+
+    Returns:
+        tuple: Ids of orders with sent and with failed remainders.
+    """
+    sent, failed = [], []
+    connection = get_connection(fail_silently=False)
+    try:
+        for order in orders:
+            message = EmailMessage(
+                subject='Payment remainder',
+                body=(
+                    f'Order created at: {order.created_at.strftime("%Y-%m-%d %H:%M")}.\n'
+                    f'Payment deadline: {order.payment_deadline.strftime("%Y-%m-%d %H:%M")}.'
+                    ),
+                from_email=settings.EMAIL_DEFAULT_FROM,
+                to=[order.client.email],
+                connection=connection,
+            )
+            try:
+                # no-op while the connection is open
+                connection.open()
+                message.send()
+            except (BadHeaderError, SMTPException, OSError):
+                failed.append(order.pk)
+                # the connection may be broken
+                with suppress(SMTPException, OSError):
+                    connection.close()
+            else:
+                sent.append(order.pk)
+    finally:
+        with suppress(SMTPException, OSError):
+            connection.close()
+    return sent, failed
+
+
 @shared_task(bind=True)
 def send_payment_remainder_mail(self):
     """
-    Sends a payment remainder email to clients who have an order with a payment deadline within the next day, and have not yet received a remainder email.
+    Dispatches payment remainder emails to clients who have an order with a payment deadline within the next day, and have not yet received a remainder email.
     
-    This task is executed asynchronously using Celery. It queries the Order model to find all orders that meet the following criteria:
+    This task is executed asynchronously using Celery. It claims the orders that meet the following criteria (see OrderQuerySet.remainder_due):
     - The order's `remainder_sent` flag is False, and the order's `payment_deadline` is within the next 24 hours.
     - The order's `remainder_force` flag is True, regardless of the `remainder_sent` flag or payment deadline.
+    Orders whose remainder failed `PAYMENT_REMAINDER['MAX_ATTEMPTS']` times are skipped.
     
-    For each qualifying order, it sends an email to the client with the order creation date and payment deadline. After the email is sent successfully, the `remainder_sent` flag is set to True and the `remainder_force` flag is set to False.
-    
-    The function returns a message indicating the number of remainder emails sent, or 'no emails to send' if there are no qualifying orders.
+    Orders are claimed in chunks of `PAYMENT_REMAINDER['BATCH_SIZE']` - locked with SELECT ... FOR UPDATE SKIP LOCKED
+    and marked with `remainder_claimed_at` and a claim token - and each chunk is sent by a `send_payment_remainder_chunk`
+    subtask. Overlapping runs skip the rows locked by each other and the orders claimed by each other.
+    Claims of chunks that were not finished (e.g. a worker was killed) expire after `PAYMENT_REMAINDER['CLAIM_TIMEOUT']`;
+    the orders are then claimed with a new token, so a late first chunk does not send them again.
     
     Args:
         self (celery.Task): The Celery task instance.
     
     Returns:
-        str: A message indicating the result of the email send operation.
+        str: A message indicating the number of dispatched remainders and chunks, or 'no emails to send'.
+    """
+    claimed_count, chunks, last_pk = 0, 0, 0
+    while True:
+        with transaction.atomic():
+            pks = list(
+                Order.objects
+                .remainder_due()
+                # keyset over pk - failed orders released by finished chunks are retried by the next run
+                .filter(pk__gt=last_pk)
+                .select_for_update(skip_locked=True)
+                .order_by('pk')
+                .values_list('pk', flat=True)[:settings.PAYMENT_REMAINDER['BATCH_SIZE']]
+            )
+            if not pks:
+                break
+            claim_token = uuid.uuid4()
+            Order.objects.filter(pk__in=pks).update(
+                remainder_claimed_at=timezone.now(),
+                remainder_claim_token=claim_token
+            )
+        send_payment_remainder_chunk.delay(pks, str(claim_token))
+        last_pk = pks[-1]
+        claimed_count += len(pks)
+        chunks += 1
+    if claimed_count == 0:
+        return 'no emails to send'
+    remainders = f'{claimed_count} remainders' if claimed_count != 1 else '1 remainder'
+    return f'{remainders} dispatched in {chunks} chunks' if chunks != 1 else f'{remainders} dispatched in 1 chunk'
+
+
+@shared_task(bind=True)
+def send_payment_remainder_chunk(self, order_ids, claim_token=None):
+    """
+    Sends payment remainders of orders claimed by `send_payment_remainder_mail`, through one SMTP connection.
+
+    Sent orders get the `remainder_sent` flag set to True and the `remainder_force` flag set to False in one update.
+    A failed message does not stop the chunk - its order's `remainder_attempts` is incremented
+    and the remainder is retried by the next dispatch. Claims are released in both cases.
+
+    Args:
+        self (celery.Task): The Celery task instance.
+        order_ids (list): Ids of the claimed orders.
+        claim_token (str): Token of the dispatch that claimed them.
+
+    Returns:
+        str: A message indicating the number of remainder emails sent and failed.
     """
+    claimed = (
+        Order.objects
+        # the claim is released once an order is sent or failed - a retried chunk skips those orders,
+        # and orders claimed again by a later dispatch (expired claim) belong to its chunk
+        .filter(pk__in=order_ids, remainder_claimed_at__isnull=False, remainder_claim_token=claim_token)
+        .filter(Q(remainder_sent=False) | Q(remainder_force=True))
+    )
+    with transaction.atomic():
+        orders = list(
+            claimed
+            .select_for_update(of=('self',))
+            .select_related('client')
+            .only('created_at', 'payment_deadline', 'client__email')
+        )
+        # renew the claim - it must not expire while the chunk is sending
+        Order.objects.filter(pk__in=[order.pk for order in orders]).update(remainder_claimed_at=timezone.now())
+    sent, failed = send_remainders(orders)
+    if sent:
+        Order.objects.filter(pk__in=sent).update(
+            remainder_sent=True,
+            remainder_force=False,
+            remainder_claimed_at=None,
+            remainder_claim_token=None
+        )
+    if failed:
+        Order.objects.filter(pk__in=failed).update(
+            remainder_attempts=F('remainder_attempts') + 1,
+            remainder_claimed_at=None,
+            remainder_claim_token=None
+        )
+    result = f'{len(sent)} remainders sent' if len(sent) != 1 else '1 remainder sent'
+    return f'{result}, {len(failed)} failed' if failed else result
 
-    notify_deadline = datetime.datetime.now() + datetime.timedelta(days=1)
-    orders = Order.objects.filter(
-        Q(
-            Q(remainder_sent=False) & 
-            Q(payment_deadline__date__lte=notify_deadline.date())  
-         
-        ) | 
-        Q(remainder_force=True)
+
+@shared_task(bind=True)
+def check_order_totals(self, fix=False):
+    """
+    Compares the stored order totals and line counts with the ones computed from the order lines.
+    
+    Orders without a stored total (not backfilled yet) are skipped.
+    
+    Args:
+        self (celery.Task): The Celery task instance.
+        fix (bool): Store the computed values for inconsistent orders.
+    
+    Returns:
+        str: The number of inconsistent orders and their ids.
+    """
+    inconsistent = list(
+        Order.objects
+        .filter(total__isnull=False)
+        .with_computed_totals()
+        .exclude(total=F('computed_total'), line_count=F('computed_line_count'))
+        .values_list('pk', flat=True)
     )
-    emails_sent_count = 0
-    if orders.count() == 0:
-        return 'no emails to send'
-    for order in orders:
-        try:
-            send_mail(
-                subject = 'Payment remainder',
-                message=(
-                    f'Order created at: {order.created_at.strftime("%Y-%m-%d %H:%M")}.\n'
-                    f'Payment deadline: {order.payment_deadline.strftime("%Y-%m-%d %H:%M")}.'
-                    ),
-                from_email=settings.EMAIL_DEFAULT_FROM,
-                recipient_list=[order.client.email],
-                fail_silently=False,
-            )
-            
-
-        except BadHeaderError:              # If mail's Subject is not properly formatted.
-            return 'Invalid header found.'
-        except SMTPException as e:          # It will catch other errors related to SMTP.
-            return f'There was an error sending an email.\n {e}'
-        except:                             # It will catch All other possible errors.
-            return 'Mail Sending Failed.'
-        order.remainder_sent = True
-        order.remainder_force = False
-        order.save()
-        emails_sent_count += 1
-    return f'{emails_sent_count} remainders sent' if emails_sent_count > 1 else f'{emails_sent_count} remainder sent'
\ No newline at end of file
+    if not inconsistent:
+        return 'order totals consistent'
+    if fix:
+        Order.objects.filter(pk__in=inconsistent).update_totals()
+    return f'{len(inconsistent)} inconsistent order totals{" fixed" if fix else ""}: {inconsistent}'
+
+
+@shared_task(bind=True)
+def rollup_daily_sales(self):
+    """
+    Rolls up order lines of closed days (before today in TIME_ZONE) into ProductDailySales.
+
+    Starts one day before the current watermark, so orders committed just after midnight are included.
+    Without a watermark, the rollup starts at the first order.
+
+    Args:
+        self (celery.Task): The Celery task instance.
+
+    Returns:
+        str: The rolled up days and the number of stored rows.
+    """
+    today = timezone.localdate()
+    day_to = ProductDailySalesRollup.get_day_to()
+    if day_to is not None:
+        day_from = day_to - datetime.timedelta(days=1)
+    else:
+        first_order = Order.objects.order_by('created_at').values_list('created_at', flat=True).first()
+        day_from = timezone.localdate(first_order) if first_order else today
+    if day_from >= today:
+        return 'daily sales up to date'
+    rows = ProductDailySales.objects.rollup(day_from, today)
+    return f'{rows} daily sales rows stored for {day_from} - {today - datetime.timedelta(days=1)}'
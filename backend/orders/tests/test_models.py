@@ -0,0 +1,101 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from backend.testing import local_settings
+from orders.models import Order, OrderData
+from orders.tasks import check_order_totals
+from products.models import Category, Product
+
+
+@local_settings
+class OrderTotalTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_user = User.objects.create_user(username='Client', email='client@dev.com')
+        cls.admin_user = User.objects.create_superuser(username='Admin', email='admin@dev.com')
+        category = Category.objects.create(name='Order test category')
+        cls.products = Product.objects.bulk_create([
+            Product(
+                name=f'Test product {product_id}',
+                description=f'despription test {product_id}',
+                price=product_id + 1,
+                category=category,
+                photo='products/photos/test.png'
+            )
+            for product_id in range(3)
+        ])
+        cls.orders = []
+        for order_id in range(10):
+            cls.create_order()
+
+    @classmethod
+    def create_order(cls):
+        order = Order.objects.create(
+            client=cls.client_user,
+            shipment_address='Test address',
+            payment_deadline=timezone.now() + timedelta(days=5)
+        )
+        OrderData.objects.bulk_create([
+            OrderData(order=order, product=product, quantity=2, product_price=product.price)
+            for product in cls.products
+        ])
+        cls.orders.append(order)
+        return order
+
+    def test_order_total_property(self):
+        self.assertEqual(Order.objects.get(pk=self.orders[0].pk).order_total, (1 + 2 + 3) * 2)
+
+    def test_order_total_annotation_does_not_query(self):
+        orders = list(Order.objects.with_order_total())
+        with self.assertNumQueries(0):
+            totals = [order.order_total for order in orders]
+        self.assertEqual(totals, [(1 + 2 + 3) * 2] * 10)
+
+    def test_admin_changelist_shows_totals_before_backfill(self):
+        self.client.force_login(self.admin_user)
+        response = self.client.get(reverse('admin:orders_order_changelist'))
+        self.assertContains(response, '<td class="field-order_total">12.00</td>', count=10, html=True)
+
+    # Benchmark - the changelist costs the same number of queries for 10 and 20 backfilled orders
+    def test_admin_changelist_query_count_does_not_depend_on_orders(self):
+        self.client.force_login(self.admin_user)
+        call_command('backfill_order_totals', stdout=StringIO())
+        # sorted by total
+        url = reverse('admin:orders_order_changelist') + '?o=5'
+        with CaptureQueriesContext(connection) as ten_orders:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        for order_id in range(10):
+            self.create_order()
+        call_command('backfill_order_totals', stdout=StringIO())
+        with CaptureQueriesContext(connection) as twenty_orders:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(len(ten_orders), len(twenty_orders))
+
+
+    # Persisted totals
+    def test_backfill_order_totals(self):
+        # an order without lines
+        Order.objects.create(
+            client=self.client_user,
+            shipment_address='Test address',
+            payment_deadline=timezone.now() + timedelta(days=5)
+        )
+        call_command('backfill_order_totals', batch_size=3, stdout=StringIO())
+        self.assertFalse(Order.objects.filter(total__isnull=True).exists())
+        self.assertEqual(Order.objects.filter(total=(1 + 2 + 3) * 2, line_count=3).count(), 10)
+        self.assertEqual(Order.objects.filter(total=0, line_count=0).count(), 1)
+
+    def test_check_order_totals(self):
+        call_command('backfill_order_totals', stdout=StringIO())
+        self.assertEqual(check_order_totals.apply().get(), 'order totals consistent')
+        Order.objects.filter(pk=self.orders[0].pk).update(total=1)
+        self.assertIn(str(self.orders[0].pk), check_order_totals.apply(kwargs={'fix': True}).get())
+        self.assertEqual(check_order_totals.apply().get(), 'order totals consistent')
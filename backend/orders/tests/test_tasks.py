@@ -0,0 +1,270 @@
+import uuid
+from datetime import timedelta
+from smtplib import SMTPRecipientsRefused, SMTPServerDisconnected
+from unittest.mock import patch
+
+import fakeredis
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from backend.queues import RateLimiter
+from backend.testing import local_settings
+from orders import mailing
+from orders.models import Order
+from orders.tasks import flush_order_confirmations, send_payment_remainder_chunk, send_payment_remainder_mail
+
+
+TOKEN = uuid.uuid4()
+
+
+def send_chunk(order_ids, claim_token):
+    # chunk subtasks run in the test process
+    return send_payment_remainder_chunk.apply(args=(order_ids, claim_token))
+
+
+@override_settings(PAYMENT_REMAINDER={'BATCH_SIZE': 2, 'MAX_ATTEMPTS': 3, 'CLAIM_TIMEOUT': 600})
+@local_settings
+@patch('orders.tasks.send_payment_remainder_chunk.delay', side_effect=send_chunk)
+class PaymentRemainderTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.clients = [
+            User.objects.create_user(username=f'Client {client_id}', email=f'client{client_id}@dev.com')
+            for client_id in range(5)
+        ]
+        now = timezone.now()
+        cls.due = [cls.create_order(client, now + timedelta(hours=12)) for client in cls.clients]
+        cls.not_due = cls.create_order(cls.clients[0], now + timedelta(days=4))
+
+    @classmethod
+    def create_order(cls, client, payment_deadline):
+        return Order.objects.create(client=client, shipment_address='Test address', payment_deadline=payment_deadline)
+
+    def test_remainders_sent_in_chunks(self, delay):
+        with patch('orders.tasks.get_connection', wraps=mail.get_connection) as get_connection:
+            self.assertEqual(send_payment_remainder_mail.apply().get(), '5 remainders dispatched in 3 chunks')
+        # one connection per chunk
+        self.assertEqual(get_connection.call_count, 3)
+        self.assertEqual(
+            [len(call.args[0]) for call in delay.call_args_list],
+            [2, 2, 1]
+        )
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [client.email for client in self.clients])
+        self.assertEqual(Order.objects.filter(remainder_sent=True, remainder_claimed_at__isnull=True).count(), 5)
+        self.assertEqual(send_payment_remainder_mail.apply().get(), 'no emails to send')
+
+    def test_chunk_query_count(self, delay):
+        order_ids = [order.pk for order in self.due]
+        Order.objects.filter(pk__in=order_ids).update(remainder_claimed_at=timezone.now(), remainder_claim_token=TOKEN)
+        # savepoint, locked orders with clients, claim renewal, release savepoint, flags update
+        with self.assertNumQueries(5):
+            self.assertEqual(send_payment_remainder_chunk.apply(args=(order_ids, str(TOKEN))).get(), '5 remainders sent')
+
+    def test_claimed_orders_not_dispatched_twice(self, delay):
+        delay.side_effect = None
+        self.assertEqual(send_payment_remainder_mail.apply().get(), '5 remainders dispatched in 3 chunks')
+        # an overlapping run, while the chunks are still queued
+        self.assertEqual(send_payment_remainder_mail.apply().get(), 'no emails to send')
+        # claims of chunks that did not finish expire
+        Order.objects.filter(pk=self.due[0].pk).update(remainder_claimed_at=timezone.now() - timedelta(minutes=11))
+        self.assertEqual(send_payment_remainder_mail.apply().get(), '1 remainder dispatched in 1 chunk')
+        for call in delay.call_args_list[1:3]:
+            send_chunk(*call.args)
+        # the order is sent by the chunk of the dispatch that claimed it again
+        self.assertEqual(send_chunk(*delay.call_args_list[3].args).get(), '1 remainder sent')
+        # the first chunk was still queued - it does not send it twice
+        self.assertEqual(send_chunk(*delay.call_args_list[0].args).get(), '1 remainder sent')
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [client.email for client in self.clients])
+
+    def test_expired_chunk_does_not_send_sent_orders(self, delay):
+        delay.side_effect = None
+        send_payment_remainder_mail.apply()
+        first_chunk = delay.call_args_list[0].args
+        Order.objects.filter(pk__in=first_chunk[0]).update(remainder_claimed_at=timezone.now() - timedelta(minutes=11))
+        send_payment_remainder_mail.apply()
+        send_chunk(*delay.call_args_list[-1].args)
+        # a late first chunk runs after the new one sent its orders
+        self.assertEqual(send_chunk(*first_chunk).get(), '0 remainders sent')
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_failed_remainders_retried(self, delay):
+        send = EmailMessage.send
+
+        def send_or_refuse(message, *args, **kwargs):
+            if message.to == [self.clients[1].email]:
+                raise SMTPRecipientsRefused({})
+            return send(message, *args, **kwargs)
+
+        with patch.object(EmailMessage, 'send', send_or_refuse):
+            send_payment_remainder_mail.apply()
+            self.assertEqual(Order.objects.filter(remainder_sent=True).count(), 4)
+            self.assertEqual(send_payment_remainder_mail.apply().get(), '1 remainder dispatched in 1 chunk')
+            send_payment_remainder_mail.apply()
+            # MAX_ATTEMPTS reached
+            self.assertEqual(send_payment_remainder_mail.apply().get(), 'no emails to send')
+        failed = Order.objects.get(pk=self.due[1].pk)
+        self.assertEqual((failed.remainder_sent, failed.remainder_attempts), (False, 3))
+        self.assertIsNone(failed.remainder_claimed_at)
+        self.assertEqual(len(mail.outbox), 4)
+        # a forced remainder is retried again
+        Order.objects.filter(pk=failed.pk).update(remainder_force=True, remainder_attempts=0)
+        self.assertEqual(send_payment_remainder_mail.apply().get(), '1 remainder dispatched in 1 chunk')
+        self.assertEqual(len(mail.outbox), 5)
+
+    # the plan must only visit pending and forced orders - past orders are many, due ones are few
+    def test_due_orders_query_uses_partial_indexes(self, delay):
+        now = timezone.now()
+        Order.objects.bulk_create([
+            Order(
+                client=self.clients[0],
+                shipment_address='Test address',
+                payment_deadline=now - timedelta(days=order_id % 100),
+                remainder_sent=True
+            )
+            for order_id in range(1000)
+        ])
+        Order.objects.filter(pk=self.not_due.pk).update(remainder_sent=True, remainder_force=True)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE orders_order')
+            cursor.execute('SET enable_seqscan = off')
+        self.addCleanup(lambda: connection.cursor().execute('RESET enable_seqscan'))
+        orders = Order.objects.remainder_due().filter(pk__gt=0).order_by('pk').values_list('pk', flat=True)[:500]
+        plan = orders.select_for_update(skip_locked=True).explain()
+        self.assertIn('order_remainder_pending_idx', plan)
+        self.assertIn('order_remainder_forced_idx', plan)
+        self.assertNotIn('orders_order_pkey', plan)
+        self.assertEqual(sorted(orders), sorted([order.pk for order in self.due] + [self.not_due.pk]))
+
+
+@override_settings(ORDER_CONFIRMATION_MAIL={'ENABLED': True, 'BATCH_SIZE': 3, 'RATE': 5, 'COUNTDOWN': 5, 'FLUSH_TIMEOUT': 60})
+@local_settings
+class OrderConfirmationMailTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        clients = [
+            User.objects.create_user(username=f'Client {client_id}', email=f'client{client_id}@dev.com')
+            for client_id in range(4)
+        ]
+        cls.orders = [
+            Order.objects.create(client=client, shipment_address='Test address', payment_deadline=timezone.now())
+            for client in clients
+        ]
+
+    def setUp(self):
+        # queues and the rate limiter in an in-memory redis
+        redis_patcher = patch('backend.queues.get_connection', return_value=fakeredis.FakeRedis())
+        redis_patcher.start()
+        self.addCleanup(redis_patcher.stop)
+        sleep_patcher = patch('backend.queues.time.sleep')
+        self.sleep = sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+    def fail_send(self, refused=(), disconnected=(), times=None):
+        """
+        Patches EmailMessage.send to refuse or drop the connection for the given addresses, `times` times.
+        """
+        send = EmailMessage.send
+        failures = []
+
+        def send_or_fail(message, *args, **kwargs):
+            if times is None or len(failures) < times:
+                if message.to[0] in refused:
+                    failures.append(message.to[0])
+                    raise SMTPRecipientsRefused({})
+                if message.to[0] in disconnected:
+                    failures.append(message.to[0])
+                    raise SMTPServerDisconnected()
+            return send(message, *args, **kwargs)
+
+        patcher = patch.object(EmailMessage, 'send', send_or_fail)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def send(self):
+        with patch('orders.mailing.mail.get_connection', wraps=mail.get_connection) as get_connection:
+            result = mailing.send(self.orders, RateLimiter('test:rate', 5))
+        # one connection for the batch
+        self.assertEqual(get_connection.call_count, 1)
+        return result
+
+    def test_confirmations_sent_at_rate(self):
+        sent, failed, error, send_time = self.send()
+        self.assertEqual(sent, [order.pk for order in self.orders])
+        self.assertEqual((failed, error), ([], None))
+        self.assertEqual(len(mail.outbox), 4)
+        # 5 messages per second - waits before every message but the first
+        self.assertEqual(self.sleep.call_count, 3)
+        self.assertTrue(all(0 < call.args[0] <= 0.6 for call in self.sleep.call_args_list))
+
+    def test_rate_shared_by_workers(self):
+        # limiters of two workers take tokens from the same bucket
+        first, second = RateLimiter('test:rate', 5), RateLimiter('test:rate', 5)
+        delays = [first.reserve(), second.reserve(), first.reserve(), second.reserve()]
+        self.assertEqual(delays[0], 0)
+        for previous, delay in zip(delays, delays[1:]):
+            self.assertAlmostEqual(delay - previous, 0.2, delta=0.05)
+
+    def test_rejected_confirmation_does_not_stop_batch(self):
+        self.fail_send(refused=[self.orders[1].client.email])
+        sent, failed, error, send_time = self.send()
+        self.assertEqual(failed, [self.orders[1].pk])
+        self.assertEqual(len(sent), 3)
+        self.assertIsNone(error)
+
+    def test_transient_error_stops_batch(self):
+        self.fail_send(disconnected=[self.orders[2].client.email])
+        sent, failed, error, send_time = self.send()
+        self.assertEqual(sent, [self.orders[0].pk, self.orders[1].pk])
+        self.assertIsInstance(error, SMTPServerDisconnected)
+        self.assertTrue(mailing.is_transient(error))
+
+    # Flush tests
+    def test_flush_sends_queued_confirmations_in_batches(self):
+        self.assertTrue(mailing.enqueue([order.pk for order in self.orders]))
+        # already scheduled
+        self.assertFalse(mailing.enqueue([self.orders[0].pk]))
+        Order.objects.filter(pk=self.orders[3].pk).delete()
+        with patch('orders.mailing.mail.get_connection', wraps=mail.get_connection) as get_connection:
+            sent, failed, lag, latency = mailing.flush()
+        self.assertEqual((sent, failed), (3, 0))
+        # one connection per batch of 3
+        self.assertEqual(get_connection.call_count, 2)
+        self.assertEqual(mailing.get_queue_stats()['depth'], 0)
+        self.assertEqual(len(mail.outbox), 3)
+        # the next confirmation schedules another flush
+        self.assertTrue(mailing.enqueue([self.orders[0].pk]))
+
+    def test_flush_requeues_unsent_confirmations(self):
+        self.fail_send(refused=[self.orders[0].client.email], disconnected=[self.orders[2].client.email])
+        mailing.enqueue([order.pk for order in self.orders])
+        scores = dict(mailing.queue.pop(4))
+        mailing.queue.requeue(scores)
+        with self.assertRaises(SMTPServerDisconnected):
+            mailing.flush()
+        # the rejected and the sent confirmation are dropped, the rest keeps its original scores
+        self.assertEqual(
+            mailing.queue.pop(4),
+            {order.pk: scores[order.pk] for order in self.orders[2:]}
+        )
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_flush_task_retried_on_transient_error(self):
+        self.fail_send(disconnected=[self.orders[2].client.email], times=1)
+        mailing.enqueue([order.pk for order in self.orders])
+        result = flush_order_confirmations.apply()
+        # the retry sent the requeued confirmations
+        self.assertTrue(result.get().startswith('2 confirmations sent, 0 rejected'))
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [order.client.email for order in self.orders])
+        self.assertEqual(mailing.get_queue_stats()['depth'], 0)
+
+    def test_flush_task_gives_up_after_max_retries(self):
+        self.fail_send(disconnected=[self.orders[0].client.email])
+        mailing.enqueue([order.pk for order in self.orders])
+        result = flush_order_confirmations.apply()
+        self.assertIsInstance(result.result, SMTPServerDisconnected)
+        self.assertEqual(mailing.get_queue_stats()['depth'], 4)
+        self.assertEqual(len(mail.outbox), 0)
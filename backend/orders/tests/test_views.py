@@ -0,0 +1,234 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core import mail
+from django.core.cache import cache
+from django.contrib.auth.models import Group, User
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from backend.testing import local_settings
+from orders import cache as top_sellers_cache
+from orders.models import Order, OrderData, ProductDailySales, ProductDailySalesRollup
+from orders.views import TopSellersListAPIView
+from products.models import Category, Product
+
+
+@local_settings
+class CreateOrderAPIViewTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Create client user, generate JWT token
+        cls.client_user = User.objects.create_user(
+            username='Client',
+            email='client@dev.com',
+            password=make_password('client_pass')
+        )
+        client_group = Group.objects.get(name='client')
+        cls.client_user.groups.add(client_group)
+        tkn = RefreshToken.for_user(cls.client_user).access_token
+        cls.client_token = {'HTTP_AUTHORIZATION':f'Bearer {tkn}'}
+
+        # Create 50 test products
+        category = Category.objects.create(name='Order test category')
+        cls.products = Product.objects.bulk_create([
+            Product(
+                name=f'Test product {product_id}',
+                description=f'despription test {product_id}',
+                price=product_id + 1,
+                category=category,
+                photo='products/photos/test.png'
+            )
+            for product_id in range(50)
+        ])
+        cls.create_url = reverse('create-order')
+
+    def create_order(self, products):
+        data = {
+            'shipment_address': 'Test address',
+            'order_data': [{'product': product.id, 'quantity': 2} for product in products],
+        }
+        return self.client.post(self.create_url, data=data, content_type='application/json', **self.client_token)
+
+    def test_order_create_allowed(self):
+        response = self.create_order(self.products[:3])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['order_data']), 3)
+        self.assertEqual(response.data['order_data'][0]['product_price'], '1.00')
+        self.assertEqual(float(response.data['order_total']), (1 + 2 + 3) * 2)
+        self.assertEqual(OrderData.objects.filter(order_id=response.data['id']).count(), 3)
+        order = Order.objects.get(pk=response.data['id'])
+        self.assertEqual((order.total, order.line_count), ((1 + 2 + 3) * 2, 3))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['client@dev.com'])
+
+    def test_order_create_unknown_product_not_allowed(self):
+        data = {
+            'shipment_address': 'Test address',
+            'order_data': [{'product': self.products[0].id, 'quantity': 1}, {'product': 0, 'quantity': 1}],
+        }
+        response = self.client.post(self.create_url, data=data, content_type='application/json', **self.client_token)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.count(), 0)
+
+    # Benchmark - creating an order costs the same number of queries for 1 and 50 lines
+    def test_order_create_query_count_does_not_depend_on_lines(self):
+        with CaptureQueriesContext(connection) as single_line:
+            self.assertEqual(self.create_order(self.products[:1]).status_code, 201)
+        with CaptureQueriesContext(connection) as fifty_lines:
+            self.assertEqual(self.create_order(self.products).status_code, 201)
+        self.assertEqual(len(single_line), len(fifty_lines))
+
+
+@local_settings
+class TopSellersListAPIViewTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Create client and manager users, generate JWT token
+        cls.client_user = User.objects.create_user(
+            username='Client',
+            email='client@dev.com',
+            password=make_password('client_pass')
+        )
+        cls.manager_user = User.objects.create_user(
+            username='Manager',
+            email='manager@dev.com',
+            password=make_password('manager_pass')
+        )
+        manager_group = Group.objects.get(name='manager')
+        cls.manager_user.groups.add(manager_group)
+        tkn = RefreshToken.for_user(cls.manager_user).access_token
+        cls.manager_token = {'HTTP_AUTHORIZATION':f'Bearer {tkn}'}
+        cls.client_user.groups.add(Group.objects.get(name='client'))
+        tkn = RefreshToken.for_user(cls.client_user).access_token
+        cls.client_token = {'HTTP_AUTHORIZATION':f'Bearer {tkn}'}
+
+        category = Category.objects.create(name='Top sellers test category')
+        cls.products = Product.objects.bulk_create([
+            Product(
+                name=f'Test product {product_id}',
+                description=f'despription test {product_id}',
+                price=product_id + 1,
+                category=category,
+                photo='products/photos/test.png'
+            )
+            for product_id in range(3)
+        ])
+        # orders at local (TIME_ZONE) midnight boundaries of 2024-05-01 and 2024-05-02
+        tz = timezone.get_current_timezone()
+        for created_at, product, quantity in [
+            (datetime(2024, 4, 30, 23, 59, tzinfo=tz), cls.products[0], 100),
+            (datetime(2024, 5, 1, 0, 0, tzinfo=tz), cls.products[1], 5),
+            (datetime(2024, 5, 2, 23, 59, tzinfo=tz), cls.products[2], 7),
+            (datetime(2024, 5, 3, 0, 0, tzinfo=tz), cls.products[1], 100),
+        ]:
+            order = Order.objects.create(
+                client=cls.client_user,
+                shipment_address='Test address',
+                payment_deadline=created_at + timedelta(days=5)
+            )
+            Order.objects.filter(pk=order.pk).update(created_at=created_at)
+            OrderData.objects.create(order=order, product=product, quantity=quantity, product_price=product.price)
+        cls.url = reverse('top-sellers') + '?products_max=10&date_min=2024-05-01&date_max=2024-05-02'
+
+    def setUp(self):
+        cache.clear()
+
+    def test_top_sellers_whole_local_days(self):
+        response = self.client.get(self.url, **self.manager_token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(row['product__name'], row['sold']) for row in response.data['results']],
+            [(self.products[2].name, 7), (self.products[1].name, 5)]
+        )
+
+    def test_top_sellers_rollup(self):
+        ProductDailySales.objects.rollup(date(2024, 4, 30), date(2024, 5, 4))
+        self.assertEqual(
+            sorted(ProductDailySales.objects.values_list('day', 'product', 'quantity', 'revenue')),
+            [
+                (date(2024, 4, 30), self.products[0].pk, 100, Decimal('100.00')),
+                (date(2024, 5, 1), self.products[1].pk, 5, Decimal('10.00')),
+                (date(2024, 5, 2), self.products[2].pk, 7, Decimal('21.00')),
+                (date(2024, 5, 3), self.products[1].pk, 100, Decimal('200.00')),
+            ]
+        )
+        self.assertEqual(ProductDailySalesRollup.get_day_to(), date(2024, 5, 4))
+        self.test_top_sellers_whole_local_days()
+
+    # days before the watermark come from the rollup, the rest from the order lines
+    def test_top_sellers_rollup_and_tail(self):
+        ProductDailySales.objects.rollup(date(2024, 4, 30), date(2024, 5, 2))
+        # the tail is read live - a late line of a rolled up day is ignored until the next rollup
+        order = Order.objects.create(
+            client=self.client_user,
+            shipment_address='Test address',
+            payment_deadline=timezone.now()
+        )
+        Order.objects.filter(pk=order.pk).update(
+            created_at=datetime(2024, 5, 2, 12, 0, tzinfo=timezone.get_current_timezone())
+        )
+        OrderData.objects.create(order=order, product=self.products[1], quantity=3, product_price=1)
+        self.assertEqual(
+            [(row['product__name'], row['sold']) for row in self.client.get(self.url, **self.manager_token).data['results']],
+            [(self.products[1].name, 8), (self.products[2].name, 7)]
+        )
+
+    # Cache tests
+    def test_top_sellers_closed_range_cached(self):
+        response = self.client.get(self.url, **self.manager_token)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        # same range with times and another page - the report is served from the cache
+        url = reverse('top-sellers') + '?products_max=10&date_min=2024-05-01T08:00&date_max=2024-05-02T10:00&limit=1'
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **self.manager_token)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual([row['product__name'] for row in response.data['results']], [self.products[2].name])
+        self.assertFalse([query for query in queries if 'orders_orderdata' in query['sql']])
+
+    def test_top_sellers_open_range_invalidated_by_new_order(self):
+        today = timezone.localdate().isoformat()
+        url = reverse('top-sellers') + f'?products_max=10&date_min={today}&date_max={today}'
+        self.assertEqual(self.client.get(url, **self.manager_token)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url, **self.manager_token)['X-Cache'], 'HIT')
+        self.client.post(reverse('create-order'), data={
+            'shipment_address': 'Test address',
+            'order_data': [{'product': self.products[0].id, 'quantity': 4}],
+        }, content_type='application/json', **self.client_token)
+        response = self.client.get(url, **self.manager_token)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(
+            [(row['product__name'], row['sold']) for row in response.data['results']],
+            [(self.products[0].name, 4)]
+        )
+        # closed ranges are not invalidated
+        self.client.get(self.url, **self.manager_token)
+        top_sellers_cache.invalidate()
+        self.assertEqual(self.client.get(self.url, **self.manager_token)['X-Cache'], 'HIT')
+
+    def test_top_sellers_yesterday_invalidated_by_new_order(self):
+        # an order created before midnight may commit after it
+        yesterday = (timezone.localdate() - timedelta(days=1)).isoformat()
+        url = reverse('top-sellers') + f'?products_max=10&date_min={yesterday}&date_max={yesterday}'
+        self.assertEqual(self.client.get(url, **self.manager_token)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url, **self.manager_token)['X-Cache'], 'HIT')
+        top_sellers_cache.invalidate()
+        self.assertEqual(self.client.get(url, **self.manager_token)['X-Cache'], 'MISS')
+
+    # the plan must stay index driven - seq scans are disabled so the planner picks an index whenever it can
+    def test_top_sellers_query_uses_indexes(self):
+        view = TopSellersListAPIView()
+        view.request = Request(RequestFactory().get(self.url))
+        with connection.cursor() as cursor:
+            cursor.execute('SET enable_seqscan = off')
+        self.addCleanup(lambda: connection.cursor().execute('RESET enable_seqscan'))
+        plan = view.get_queryset().explain()
+        self.assertIn('order_created_at_idx', plan)
+        self.assertIn('orderdata_order_product_idx', plan)
+        self.assertNotIn('Seq Scan on orders_order', plan)
@@ -0,0 +1,11 @@
+from datetime import datetime, time
+
+from django.utils import timezone
+
+
+def day_start(day):
+    """
+    Returns the aware datetime of midnight starting the given date in TIME_ZONE.
+    Days are compared as half-open [day_start(a), day_start(b)) ranges, so the created_at index can be used.
+    """
+    return timezone.make_aware(datetime.combine(day, time.min))
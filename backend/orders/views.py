@@ -1,6 +1,10 @@
 from typing import List
+from datetime import timedelta
+from itertools import chain
+import heapq
 import dateutil.parser
 
+from django.core.cache import cache
 from django.db.models import F, Sum
 from rest_framework import filters, generics, permissions, status
 from rest_framework.exceptions import APIException
@@ -8,8 +12,10 @@ from rest_framework.response import Response
 from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiParameter, extend_schema_field
 from rest_framework.schemas.openapi import AutoSchema
 
-from .models import Order, OrderData
+from . import cache as top_sellers_cache
+from .models import Order, OrderData, ProductDailySales, ProductDailySalesRollup
 from .serializers import ForceRemainder, OrderSerializer, TopSellers
+from .utils import day_start
 
 from products.models import Product
 from users.permissions import IsClient, IsManager
@@ -44,7 +50,10 @@ class TopSellersListAPIView(generics.ListAPIView):
     permission_classes = [IsManager]
     queryset = Product.objects.none()
 
-    def get_queryset(self):
+    def get_report_params(self):
+        """
+        Returns the validated products limit and the half-open range of days [day_from, day_to).
+        """
         products_max = self.request.GET.get('products_max', None)
         date_min = self.request.GET.get('date_min', None)
         date_max = self.request.GET.get('date_max', None)
@@ -54,10 +63,51 @@ class TopSellersListAPIView(generics.ListAPIView):
         date_min = dateutil.parser.parse(date_min)
         if not products_max.isdigit():
             raise APIException('Provide required arguments: products_max (int).')
-        orders = Order.objects.filter(created_at__date__gte=date_min, created_at__date__lte=date_max)
-        qs = OrderData.objects.filter(order__in=orders).values('product','product__name').annotate(sold=Sum('quantity'))
-        qs = qs.order_by('-sold')[:int(products_max)]
-        return qs
+        return int(products_max), date_min.date(), date_max.date() + timedelta(days=1)
+
+    def list(self, request, *args, **kwargs):
+        # the report is cached as a whole, pages are cut from it
+        key, timeout = top_sellers_cache.get_key(*self.get_report_params())
+        report = cache.get(key)
+        hit = report is not None
+        if not hit:
+            report = list(self.get_queryset())
+            cache.set(key, report, timeout)
+        page = self.paginate_queryset(report)
+        if page is not None:
+            response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+        else:
+            response = Response(self.get_serializer(report, many=True).data)
+        response['X-Cache'] = 'HIT' if hit else 'MISS'
+        return response
+
+    def get_queryset(self):
+        products_max, day_from, day_to = self.get_report_params()
+        # days before the watermark are summed from the daily rollup, later ones from the order lines
+        rolled_up_to = ProductDailySalesRollup.get_day_to() or day_from
+        rolled_up_to = min(max(rolled_up_to, day_from), day_to)
+        rollup = (ProductDailySales.objects
+                  .filter(day__gte=day_from, day__lt=rolled_up_to)
+                  .values('product', 'product__name')
+                  .annotate(sold=Sum('quantity')))
+        # half-open range of whole days in TIME_ZONE - compares the raw column, so the created_at index is used
+        tail = (OrderData.objects
+                .filter(order__created_at__gte=day_start(rolled_up_to), order__created_at__lt=day_start(day_to))
+                .values('product','product__name')
+                .annotate(sold=Sum('quantity')))
+        if rolled_up_to == day_to:
+            return rollup.order_by('-sold')[:products_max]
+        if rolled_up_to == day_from:
+            return tail.order_by('-sold')[:products_max]
+        sold = {}
+        for row in chain(rollup, tail):
+            key = (row['product'], row['product__name'])
+            sold[key] = sold.get(key, 0) + row['sold']
+        top = heapq.nlargest(products_max, sold.items(), key=lambda item: item[1])
+        return [
+            {'product': product, 'product__name': name, 'sold': quantity}
+            for (product, name), quantity in top
+        ]
     
 # Force sending the payment remainder email - DEMO
 class ForceRemainderAPIView(generics.GenericAPIView):
@@ -70,7 +120,7 @@ class ForceRemainderAPIView(generics.GenericAPIView):
         if 'order_id' in self.request.data:
             order_id = self.request.data['order_id']
             qs = Order.objects.filter(id=order_id)
-            qs.update(remainder_force=True)
+            qs.update(remainder_force=True, remainder_attempts=0)
         serializer = self.get_serializer(qs, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -0,0 +1,102 @@
+"""
+Cache of catalog (product and category) list and detail responses.
+
+Responses are keyed by the request host, path and sorted query params, and by a catalog version.
+Saving or deleting any product or category increments the version once the transaction commits,
+so all cached catalog responses are invalidated at once - the catalog changes rarely.
+
+The key also gives the strong ETag of the response, so a matching `If-None-Match` is answered
+with 304 before the cache or the database are read.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from .models import Category, Product
+
+
+KEY = 'catalog:{}:{}'
+VERSION_KEY = 'catalog:version'
+
+
+def get_key(request):
+    params = sorted(request.query_params.lists())
+    # absolute media urls depend on the host and scheme
+    raw = f'{request.scheme}://{request.get_host()}{request.path}?{params}'
+    version = cache.get_or_set(VERSION_KEY, 0, timeout=None)
+    return KEY.format(version, hashlib.md5(raw.encode()).hexdigest())
+
+
+def get_etag(key):
+    return quote_etag(hashlib.md5(key.encode()).hexdigest())
+
+
+def invalidate():
+    cache.add(VERSION_KEY, 0, timeout=None)
+    cache.incr(VERSION_KEY)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_on_commit(sender, **kwargs):
+    transaction.on_commit(invalidate)
+
+
+class CachedReadMixin:
+    """
+    Serves viewset `list()` and `retrieve()` responses from the catalog cache.
+
+    Only successful responses are cached. Responses carry an `X-Cache` HIT/MISS header, an ETag,
+    and detail responses also `Last-Modified` (`get_last_modified()`, the object's `updated_at` by default).
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_object(self):
+        obj = super().get_object()
+        self.last_modified = self.get_last_modified(obj)
+        return obj
+
+    def get_last_modified(self, obj):
+        return obj.updated_at
+
+    def cached_response(self, view, request, *args, **kwargs):
+        key = get_key(request)
+        etag = get_etag(key)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            return not_modified
+        cached = cache.get(key)
+        if cached is not None:
+            data, last_modified = cached
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+        else:
+            self.last_modified = None
+            response = view(request, *args, **kwargs)
+            last_modified = self.last_modified
+            if response.status_code == 200:
+                cache.set(key, (response.data, last_modified), settings.CATALOG_CACHE['TIMEOUT'])
+            response['X-Cache'] = 'MISS'
+        if response.status_code != 200:
+            return response
+        response['ETag'] = etag
+        if last_modified is None:
+            return response
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+        # If-Modified-Since without If-None-Match
+        return get_conditional_response(request, etag, int(last_modified.timestamp()), response)
@@ -1,11 +1,17 @@
 from django_elasticsearch_dsl import Document, fields
 from django_elasticsearch_dsl.registries import registry
+from elasticsearch_dsl import UpdateByQuery
 
 from .models import Category, Product
+from .utils import fetch_thumbnails, get_thumbnail_url
+from .variants import get_variant_urls
 
 
 @registry.register_document
 class CategoryDocument(Document):
+    # keyword sub-field for sorting
+    name = fields.TextField(fields={'raw': fields.KeywordField()})
+
     class Index:
         name = 'categories'
         settings = {
@@ -17,16 +23,28 @@ class CategoryDocument(Document):
         model = Category
         fields = [
             'id',
-            'name'
         ]
 
-# TODO: update Product.Category.name on Category.name change
 @registry.register_document
 class ProductDocument(Document):
+    """
+    Product search document.
+
+    Stores every field returned by the product listing (including photo and thumbnail urls),
+    so search results are served from the hits without a database round trip.
+    """
+    name = fields.TextField(fields={'raw': fields.KeywordField()})
+    price = fields.ScaledFloatField(scaling_factor=100)
     category = fields.ObjectField(properties={
-            "name": fields.TextField()
+            # only used in term filters - keyword is faster than numeric types for exact lookups
+            "id": fields.KeywordField(),
+            "name": fields.TextField(fields={'raw': fields.KeywordField()}),
         })
-    
+    # media urls are only returned, never searched
+    photo = fields.KeywordField(index=False)
+    thumbnail = fields.KeywordField(index=False)
+    srcset = fields.ObjectField(enabled=False)
+
     class Index:
         name = 'products'
         settings = {
@@ -38,6 +56,41 @@ class ProductDocument(Document):
         model = Product
         fields = [
             'id',
-            'name',
             'description'
-        ]
\ No newline at end of file
+        ]
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('category')
+
+    def get_actions(self, object_list, action):
+        object_list = list(object_list)
+        if action != 'delete':
+            # thumbnail metadata of the whole batch in one query
+            fetch_thumbnails([product.photo for product in object_list])
+        return super().get_actions(object_list, action)
+
+    def prepare_photo(self, instance):
+        return instance.photo.url if instance.photo else None
+
+    def prepare_thumbnail(self, instance):
+        return get_thumbnail_url(instance.photo, 'small')
+
+    def prepare_srcset(self, instance):
+        return get_variant_urls(instance.photo)
+
+    @classmethod
+    def update_category_name(cls, category_id, name):
+        """
+        Propagates a category rename to the denormalized `category.name` of its products.
+
+        Runs a single update-by-query over the documents that still have another name,
+        so saving a category without renaming it does not rewrite anything.
+        Returns the number of updated documents.
+        """
+        ubq = (UpdateByQuery(using=cls._get_using(), index=cls._index._name)
+               .filter('term', **{'category.id': str(category_id)})
+               .exclude('term', **{'category.name.raw': name})
+               .script(source='ctx._source.category.name = params.name', params={'name': name})
+               # a conflicting document was reindexed from the database meanwhile - it has the new name
+               .params(conflicts='proceed', slices='auto'))
+        return ubq.execute().updated
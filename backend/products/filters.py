@@ -0,0 +1,61 @@
+from django.core.exceptions import ValidationError
+from rest_framework import filters, serializers
+
+
+class SearchFilterBackend:
+    """
+    Applies the view's `filterset_fields` to an Elasticsearch search.
+
+    Filters go into the bool query `filter` context (not scored, cached by Elasticsearch),
+    so they are applied before paging instead of over a truncated result.
+    `view.search_filter_fields` maps model field names to document fields.
+    Values are validated with the model field, e.g. `price__gte=abc` gives a 400 response.
+    """
+
+    range_lookups = ('gt', 'gte', 'lt', 'lte')
+
+    def filter_search(self, request, search, view):
+        model = view.get_queryset().model
+        for field_name, lookups in getattr(view, 'filterset_fields', {}).items():
+            document_field = view.search_filter_fields[field_name]
+            model_field = model._meta.get_field(field_name)
+            # FK filters take the related object's pk
+            model_field = getattr(model_field, 'target_field', model_field)
+            value_range = {}
+            for lookup in lookups:
+                param = field_name if lookup == 'exact' else f'{field_name}__{lookup}'
+                value = request.query_params.get(param)
+                if value in (None, ''):
+                    continue
+                try:
+                    value = model_field.to_python(value)
+                except ValidationError as e:
+                    raise serializers.ValidationError({param: e.messages})
+                if lookup == 'exact':
+                    search = search.filter('term', **{document_field: str(value)})
+                elif lookup in self.range_lookups:
+                    value_range[lookup] = float(value)
+            if value_range:
+                search = search.filter('range', **{document_field: value_range})
+        return search
+
+
+class SearchOrderingFilter(filters.OrderingFilter):
+    """
+    OrderingFilter counterpart for Elasticsearch searches.
+
+    Accepts the same `ordering` values as the database listing (validated against `ordering_fields`)
+    and sorts by the matching `view.search_ordering_fields` document field.
+    Ties are broken by id, so pages are stable. Hits are sorted by relevance if no ordering is given.
+    """
+
+    def filter_search(self, request, search, view):
+        ordering = self.get_ordering(request, None, view)
+        if not ordering:
+            return search
+        sort = []
+        for term in ordering:
+            field = view.search_ordering_fields[term.lstrip('-')]
+            sort.append({field: {'order': 'desc' if term.startswith('-') else 'asc'}})
+        sort.append({'id': {'order': 'asc'}})
+        return search.sort(*sort)
@@ -0,0 +1,26 @@
+"""
+Thumbnail generation outside the upload request.
+
+Product photos are saved without thumbnails. Saving a product with a photo schedules
+`generate_product_thumbnails` once the transaction commits. Until the thumbnail is generated,
+responses and search documents use the original photo url (see utils.get_thumbnail_url).
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Product
+from .tasks import generate_product_thumbnails
+
+
+@receiver(post_save, sender=Product)
+def schedule_thumbnails(sender, instance, **kwargs):
+    if not instance.photo:
+        return
+    if not settings.PRODUCT_THUMBNAILS['ASYNC']:
+        generate_product_thumbnails.apply(args=([instance.pk],), throw=True)
+        return
+    pk = instance.pk
+    # the task skips existing thumbnails, so saves that keep the photo cost one no-op task
+    transaction.on_commit(lambda: generate_product_thumbnails.delay([pk]))
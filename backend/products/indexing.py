@@ -0,0 +1,92 @@
+"""
+Queue of search documents waiting to be (re)indexed.
+
+Saved and deleted rows are stored as `(model, pk)` in a Redis sorted set per model, scored by the time
+they were first queued - saving the same row again before the flush does not add a second entry.
+`flush()` pops the queued ids in batches and syncs them with the Elasticsearch bulk API:
+rows that still exist are indexed, rows that are gone are deleted from the index.
+"""
+import time
+
+from django.conf import settings
+from django_elasticsearch_dsl.registries import registry
+from elasticsearch.helpers import bulk
+
+from backend.queues import Queue, get_connection
+
+
+QUEUE_KEY = 'search_index:queue:{}'
+FLUSH_SCHEDULED_KEY = 'search_index:flush_scheduled'
+PAUSED_KEY = 'search_index:paused'
+
+
+def get_queue(model):
+    return Queue(QUEUE_KEY.format(model._meta.label_lower), FLUSH_SCHEDULED_KEY)
+
+
+def enqueue(model, pks):
+    """
+    Queues model rows for indexing. Returns True if a flush should be scheduled.
+    """
+    return get_queue(model).enqueue(pks, settings.SEARCH_INDEX_QUEUE['FLUSH_TIMEOUT'])
+
+
+def get_queue_stats():
+    """
+    Returns the number of queued rows and the age in seconds of the oldest one (queue lag) per model.
+    """
+    return {model._meta.label_lower: get_queue(model).get_stats() for model in registry.get_models()}
+
+
+def pause(timeout):
+    """
+    Keeps queued rows in the queue (e.g. while an index is rebuilt) for at most `timeout` seconds.
+    """
+    get_connection().set(PAUSED_KEY, time.time(), ex=timeout)
+
+
+def resume():
+    get_connection().delete(PAUSED_KEY)
+
+
+def flush(batch_size=None):
+    """
+    Indexes all queued rows, `batch_size` rows per bulk request. Does nothing while the queue is paused.
+
+    A failed batch is put back in the queue with its original scores before the error is raised.
+    Returns the number of synced rows and the highest queue lag seen.
+    """
+    batch_size = batch_size or settings.SEARCH_INDEX_QUEUE['BATCH_SIZE']
+    if get_connection().exists(PAUSED_KEY):
+        return 0, 0.0
+    # rows queued from now on must schedule another flush
+    get_connection().delete(FLUSH_SCHEDULED_KEY)
+    synced, max_lag = 0, 0.0
+    for model in registry.get_models():
+        queue = get_queue(model)
+        while batch := queue.pop(batch_size):
+            try:
+                index_batch(model, list(batch))
+            except Exception:
+                queue.requeue(batch)
+                raise
+            synced += len(batch)
+            max_lag = max(max_lag, time.time() - min(batch.values()))
+    return synced, max_lag
+
+
+def index_batch(model, pks):
+    """
+    Syncs the documents of the given model rows with one bulk request per document class.
+    """
+    for doc_class in registry.get_documents([model]):
+        doc = doc_class()
+        instances = list(doc.get_queryset().filter(pk__in=pks))
+        deleted = set(pks) - {instance.pk for instance in instances}
+        actions = list(doc.get_actions(instances, 'index'))
+        actions += [
+            {'_op_type': 'delete', '_index': doc._index._name, '_id': pk}
+            for pk in deleted
+        ]
+        # 404 on delete - the row was never indexed
+        bulk(doc._get_connection(), actions, ignore_status=404)
@@ -0,0 +1,153 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from PIL import Image
+from thumbnails import images, post_processors, processors
+from thumbnails.backends.storage import get_backend
+from thumbnails.models import Source, ThumbnailMeta
+
+from products import variants
+from products.models import Product
+from products.tasks import refresh_products
+
+def render(job):
+    """
+    Renders and stores the missing thumbnails of one photo. Runs in a worker process and does not use the database.
+
+    Returns:
+        tuple: The photo name, the stored `(size, thumbnail name)` pairs and False if the photo could not be read.
+    """
+    source_name, sizes, existing, force, with_variants = job
+    storage = get_backend()
+    stored = []
+    try:
+        # opened once per photo - every size and the variants read it from the start
+        with storage.open(source_name) as source_file:
+            for size in sizes:
+                source_file.seek(0)
+                file = processors.process(source_file, size)
+                file = post_processors.process(file, size)
+                stored.append((size, storage.save(images.get_thumbnail_name(source_name, size), file)))
+            if with_variants:
+                source_file.seek(0)
+                source = Image.open(source_file)
+                missing = variants.get_missing(source, existing, force=force)
+                for width, resized in variants.resize(source, missing):
+                    for image_format in missing[width]:
+                        name = storage.save(
+                            variants.get_variant_name(source_name, width, image_format),
+                            ContentFile(variants.encode(resized, image_format)),
+                        )
+                        stored.append((variants.get_size_name(width, image_format), name))
+    except OSError:
+        # the photo file is missing or not an image
+        return source_name, stored, False
+    return source_name, stored, True
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates missing thumbnails and responsive variants of all product photos in a local process pool, '
+        'e.g. after adding a size to THUMBNAILS["SIZES"]. An interrupted run is resumed with --after '
+        'and the last id of its progress output.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size', nargs='*', default=None,
+            help='Thumbnail sizes to generate, e.g. small. Default: PRODUCT_THUMBNAILS["SIZES"].'
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Regenerate existing thumbnails, e.g. after changing the processors of a size.'
+        )
+        parser.add_argument(
+            '--no-variants', action='store_true',
+            help='Skip the responsive variants (PRODUCT_THUMBNAILS["VARIANT_WIDTHS"]).'
+        )
+        parser.add_argument('--chunk-size', type=int, default=200, help='Products per chunk.')
+        parser.add_argument('--workers', type=int, default=None, help='Worker processes. Default: number of CPUs.')
+        parser.add_argument('--after', type=int, default=0, help='Start after this product id, e.g. to resume a run.')
+
+    def handle(self, *args, **options):
+        sizes = options['size'] or settings.PRODUCT_THUMBNAILS['SIZES']
+        unknown = set(sizes) - set(settings.THUMBNAILS['SIZES'])
+        if unknown:
+            raise CommandError(f'Unknown thumbnail sizes: {", ".join(sorted(unknown))}')
+        last_pk = options['after']
+
+        products = Product.objects.exclude(photo='').order_by('pk')
+        total = products.filter(pk__gt=last_pk).count()
+        done = generated = missing = 0
+        start = time.monotonic()
+        # fork - workers inherit the configured settings; they only use the storage, never the database connection
+        with ProcessPoolExecutor(
+            max_workers=options['workers'],
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=django.setup,
+        ) as executor:
+            # keyset over pk - one chunk of ids and photo names in memory at a time
+            while chunk := list(
+                products.filter(pk__gt=last_pk).values_list('pk', 'photo')[:options['chunk_size']]
+            ):
+                chunk_generated, chunk_missing, updated = self.backfill_chunk(
+                    executor, chunk, sizes, options['force'], not options['no_variants']
+                )
+                if updated:
+                    refresh_products(updated)
+                last_pk = chunk[-1][0]
+                done += len(chunk)
+                generated += chunk_generated
+                missing += chunk_missing
+                elapsed = time.monotonic() - start
+                self.stdout.write(
+                    f'{done}/{total} products, {generated} thumbnails generated, {missing} missing photos, '
+                    f'{done / elapsed:.1f} products/s (last id: {last_pk})'
+                )
+        self.stdout.write(self.style.SUCCESS(f'Done, {generated} thumbnails generated for {done} products.'))
+
+    def backfill_chunk(self, executor, chunk, sizes, force, with_variants):
+        """
+        Renders the thumbnails of a chunk of `(pk, photo name)` pairs in the pool and stores their metadata in bulk.
+
+        Returns:
+            tuple: The number of generated thumbnails, of missing photos and the ids of products with new thumbnails.
+        """
+        names = {name for _, name in chunk}
+        # photos assigned by name were never registered
+        Source.objects.bulk_create([Source(name=name) for name in names], ignore_conflicts=True)
+        source_ids = dict(Source.objects.filter(name__in=names).values_list('name', 'id'))
+        existing = {}
+        for meta in ThumbnailMeta.objects.filter(source_id__in=source_ids.values()).select_related('source'):
+            existing.setdefault(meta.source.name, {})[meta.size] = meta
+
+        jobs = [
+            (name, [size for size in sizes if force or size not in existing.get(name, {})],
+             set(existing.get(name, {})), force, with_variants)
+            for name in sorted(names)
+        ]
+        new, replaced, missing, rendered = [], [], 0, set()
+        for name, stored, found in executor.map(render, jobs):
+            if not found:
+                missing += 1
+            for size, thumbnail_name in stored:
+                if size in existing.get(name, {}):
+                    replaced.append(existing[name][size])
+                new.append(ThumbnailMeta(source_id=source_ids[name], size=size, name=thumbnail_name))
+            if stored:
+                rendered.add(name)
+
+        with transaction.atomic():
+            ThumbnailMeta.objects.filter(pk__in=[meta.pk for meta in replaced]).delete()
+            # a thumbnail generated meanwhile by the Celery task is kept
+            ThumbnailMeta.objects.bulk_create(new, ignore_conflicts=True)
+        storage = get_backend()
+        for meta in replaced:
+            storage.delete(meta.name)
+        return len(new), missing, [pk for pk, name in chunk if name in rendered]
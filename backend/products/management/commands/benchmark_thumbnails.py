@@ -0,0 +1,56 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from PIL import Image
+from thumbnails import post_processors, processors
+
+from products.models import Product
+from products.variants import encode, get_formats, get_size_name, get_widths, resize
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the bytes and generation time of the responsive variants with the small thumbnail '
+        'on the photos of the first products. Nothing is saved.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=20, help='Number of product photos.')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(photo='').order_by('pk').only('photo')[:options['count']]
+        size_bytes = {}
+        small_time = variants_time = 0.0
+        photos = 0
+        for product in products:
+            storage = product.photo.thumbnails.storage
+            try:
+                start = time.perf_counter()
+                small = processors.process(storage.open(product.photo.name), 'small')
+                small = post_processors.process(small, 'small')
+                small_time += time.perf_counter() - start
+                size_bytes.setdefault('small', []).append(small.size)
+
+                start = time.perf_counter()
+                with storage.open(product.photo.name) as file:
+                    source = Image.open(file)
+                    formats = get_formats(source.format)
+                    for width, resized in resize(source, get_widths(source)):
+                        for image_format in formats:
+                            data = encode(resized, image_format)
+                            size_bytes.setdefault(get_size_name(width, image_format), []).append(len(data))
+                variants_time += time.perf_counter() - start
+            except OSError:
+                # the photo file is missing or not an image
+                continue
+            photos += 1
+
+        if not photos:
+            self.stdout.write('No product photos found.')
+            return
+        self.stdout.write(f'{photos} photos, variant widths {settings.PRODUCT_THUMBNAILS["VARIANT_WIDTHS"]}')
+        for size, sizes in size_bytes.items():
+            self.stdout.write(f'{size:>10}: {sum(sizes) // len(sizes):>9} bytes avg')
+        self.stdout.write(f'small thumbnail generated in {small_time / photos * 1000:.1f} ms per photo')
+        self.stdout.write(f'all variants generated in {variants_time / photos * 1000:.1f} ms per photo')
@@ -0,0 +1,148 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections as db_connections
+from django.db.models import Max, Min
+from django_elasticsearch_dsl.registries import registry
+from elasticsearch.helpers import bulk
+from elasticsearch_dsl.connections import connections as es_connections
+
+from products import indexing
+
+
+def init_worker():
+    # connections inherited from the parent process must not be shared
+    db_connections.close_all()
+    es_connections.configure()
+    es_connections.configure(**settings.ELASTICSEARCH_DSL)
+
+
+def index_slice(doc_class, index_name, pk_min, pk_max, chunk_size):
+    """
+    Indexes rows with pk in [pk_min, pk_max) into `index_name`. Returns the number of indexed rows.
+    """
+    doc = doc_class()
+    # iterator() streams rows through a server-side cursor
+    rows = doc.get_queryset().filter(pk__gte=pk_min, pk__lt=pk_max).order_by('pk').iterator(chunk_size=chunk_size)
+    indexed = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            indexed += index_chunk(doc, index_name, chunk)
+            chunk = []
+    if chunk:
+        indexed += index_chunk(doc, index_name, chunk)
+    return indexed
+
+
+def index_chunk(doc, index_name, chunk):
+    actions = [dict(action, _index=index_name) for action in doc.get_actions(chunk, 'index')]
+    indexed, _ = bulk(doc._get_connection(), actions, chunk_size=len(actions))
+    return indexed
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds search indices without downtime: documents are loaded into a new versioned index '
+        'in parallel slices, then the index alias is atomically switched to it.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--index', nargs='*', default=None,
+            help='Names of the indices (aliases) to rebuild, e.g. products. Default: all.'
+        )
+        parser.add_argument('--processes', type=int, default=4, help='Number of worker processes.')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows per database fetch and bulk request.')
+        parser.add_argument('--keep-old', action='store_true', help='Do not delete the previous index.')
+
+    def handle(self, *args, **options):
+        documents = [
+            doc for doc in registry.get_documents()
+            if options['index'] is None or doc._index._name in options['index']
+        ]
+        if not documents:
+            raise CommandError('No documents to rebuild.')
+        # changes made during the rebuild stay queued and are flushed to the new index after the switch
+        indexing.pause(timeout=6 * 60 * 60)
+        try:
+            for doc_class in documents:
+                self.rebuild(doc_class, options)
+        finally:
+            indexing.resume()
+        synced, _ = indexing.flush()
+        self.stdout.write(f'{synced} documents changed during the rebuild synced.')
+
+    def rebuild(self, doc_class, options):
+        alias = doc_class._index._name
+        index_name = f'{alias}-{time.strftime("%Y%m%d%H%M%S")}'
+        client = doc_class._get_connection()
+
+        # no refreshes and replicas while loading, restored before the switch
+        index = doc_class._index.clone(name=index_name)
+        index.settings(refresh_interval='-1', number_of_replicas=0)
+        index.create()
+        self.stdout.write(f'Indexing {doc_class.django.model._meta.label} into {index_name}...')
+
+        start = time.monotonic()
+        indexed = 0
+        slices = self.get_slices(doc_class, options['processes'])
+        db_connections.close_all()
+        with ProcessPoolExecutor(
+            max_workers=options['processes'], mp_context=get_context('fork'), initializer=init_worker
+        ) as executor:
+            futures = [
+                executor.submit(index_slice, doc_class, index_name, pk_min, pk_max, options['chunk_size'])
+                for pk_min, pk_max in slices
+            ]
+            for future in futures:
+                indexed += future.result()
+        elapsed = time.monotonic() - start
+
+        client.indices.put_settings(index=index_name, settings={
+            'refresh_interval': None,
+            'number_of_replicas': doc_class._index._settings.get('number_of_replicas', 1),
+        })
+        client.indices.refresh(index=index_name)
+        deleted = self.switch_alias(client, alias, index_name, options['keep_old'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{indexed} documents indexed in {elapsed:.1f}s ({indexed / max(elapsed, 0.001):.0f} docs/s), '
+            f'{alias} -> {index_name}'
+        ))
+        if deleted:
+            self.stdout.write(f'Deleted: {", ".join(deleted)}')
+
+    def get_slices(self, doc_class, count):
+        """
+        Splits the pk range into `count` * 4 slices, so faster workers pick up more of them.
+        """
+        bounds = doc_class().get_queryset().aggregate(pk_min=Min('pk'), pk_max=Max('pk'))
+        if bounds['pk_min'] is None:
+            return []
+        pk_min, pk_max = bounds['pk_min'], bounds['pk_max'] + 1
+        step = max((pk_max - pk_min) // (count * 4), 1)
+        return [(start, min(start + step, pk_max)) for start in range(pk_min, pk_max, step)]
+
+    def switch_alias(self, client, alias, index_name, keep_old):
+        """
+        Points the alias to the new index in one atomic request. Returns the deleted indices.
+        """
+        actions = [{'add': {'index': index_name, 'alias': alias}}]
+        deleted = []
+        if client.indices.exists_alias(name=alias):
+            for old in client.indices.get_alias(name=alias).body.keys():
+                if keep_old:
+                    actions.append({'remove': {'index': old, 'alias': alias}})
+                else:
+                    actions.append({'remove_index': {'index': old}})
+                    deleted.append(old)
+        elif client.indices.exists(index=alias):
+            # index created by search_index --create - an alias cannot share its name, so it has to go
+            actions.append({'remove_index': {'index': alias}})
+            deleted.append(alias)
+        client.indices.update_aliases(actions=actions)
+        return deleted
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from products.models import Product
+from products.tasks import generate_product_thumbnails
+
+
+class Command(BaseCommand):
+    help = (
+        'Queues thumbnail generation of all product photos in chunks, '
+        'so the Celery worker pool processes them in parallel.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size', nargs='*', default=None,
+            help='Thumbnail sizes to generate, e.g. small. Default: PRODUCT_THUMBNAILS["SIZES"].'
+        )
+        parser.add_argument('--force', action='store_true', help='Regenerate existing thumbnails.')
+        parser.add_argument(
+            '--no-variants', action='store_true',
+            help='Skip the responsive variants (PRODUCT_THUMBNAILS["VARIANT_WIDTHS"]).'
+        )
+        parser.add_argument('--chunk-size', type=int, default=100, help='Products per task.')
+
+    def handle(self, *args, **options):
+        sizes = options['size'] or settings.PRODUCT_THUMBNAILS['SIZES']
+        unknown = set(sizes) - set(settings.THUMBNAILS['SIZES'])
+        if unknown:
+            raise CommandError(f'Unknown thumbnail sizes: {", ".join(sorted(unknown))}')
+        products = Product.objects.exclude(photo='').order_by('pk')
+        last_pk = 0
+        queued = tasks = 0
+        # keyset over pk - only ids are loaded here, the workers load the photos
+        while pks := list(
+            products.filter(pk__gt=last_pk).values_list('pk', flat=True)[:options['chunk_size']]
+        ):
+            generate_product_thumbnails.delay(pks, sizes, options['force'], not options['no_variants'])
+            queued += len(pks)
+            tasks += 1
+            last_pk = pks[-1]
+        self.stdout.write(self.style.SUCCESS(f'Done, {queued} products queued in {tasks} tasks.'))
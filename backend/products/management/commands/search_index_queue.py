@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from products import indexing
+
+
+class Command(BaseCommand):
+    help = 'Shows the depth and lag of the search indexing queue, optionally flushes it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--flush', action='store_true', help='Index all queued rows now, without Celery.')
+
+    def handle(self, *args, **options):
+        for model, stats in indexing.get_queue_stats().items():
+            self.stdout.write(f"{model}: {stats['depth']} queued, lag {stats['lag']:.1f}s")
+        if options['flush']:
+            synced, lag = indexing.flush()
+            self.stdout.write(self.style.SUCCESS(f'{synced} documents synced, queue lag {lag:.1f}s'))
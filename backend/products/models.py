@@ -6,6 +6,15 @@ from thumbnails.fields import ImageField
 
 class Category(models.Model):
     name = models.CharField(max_length=30)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # keyset pagination, see products.pagination
+            models.Index(fields=['name', 'id'], name='category_name_id_idx'),
+            # catalog export updated_since, see products.export
+            models.Index(fields=['updated_at'], name='category_updated_at_idx'),
+        ]
     
 
 class Product(models.Model):
@@ -13,4 +22,16 @@ class Product(models.Model):
     description = models.TextField()
     price = models.DecimalField(max_digits=9, decimal_places=2)
     category = models.ForeignKey(Category, on_delete=models.PROTECT)
-    photo = ImageField(upload_to='products/photos', pregenerated_sizes=["small"])
+    # thumbnails are generated by a Celery task, see products.images
+    photo = ImageField(upload_to='products/photos')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # keyset pagination per ordering field, see products.pagination
+            models.Index(fields=['name', 'id'], name='product_name_id_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['category', 'id'], name='product_category_id_idx'),
+            # catalog export updated_since, see products.export
+            models.Index(fields=['updated_at'], name='product_updated_at_idx'),
+        ]
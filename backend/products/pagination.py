@@ -0,0 +1,197 @@
+import base64
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from rest_framework import filters
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class SearchLimitOffsetPagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination that can also page Elasticsearch searches.
+
+    `paginate_queryset()` works as usual for database listings. `paginate_search()` slices
+    the search itself, so only the requested page is fetched from Elasticsearch,
+    and takes the count from the total number of hits - no database query is made.
+    """
+
+    # Elasticsearch index.max_result_window default - deeper pages are rejected by the cluster
+    max_result_window = 10000
+
+    def paginate_search(self, search, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.offset = self.get_offset(request)
+
+        # do not ask for hits past the result window
+        end = min(self.offset + self.limit, self.max_result_window)
+        start = min(self.offset, end)
+        response = search.extra(track_total_hits=True)[start:end].execute()
+        self.count = response.hits.total.value
+        return [hit.to_dict() for hit in response]
+
+
+class KeysetLimitOffsetPagination(SearchLimitOffsetPagination):
+    """
+    SearchLimitOffsetPagination with an opt-in keyset (cursor) mode for database listings.
+
+    Requests with a `cursor` param (empty for the first page) get the `limit` rows after the cursor position
+    in the `ordering` order, tie-broken by id - a filter on the ordering columns that an index on
+    `(<ordering field>, id)` answers directly, instead of scanning and discarding every row before `offset`.
+    Pages are stable while rows are inserted or deleted. Only a `next` link is returned.
+    `view.keyset_ordering_fields` maps ordering fields to the columns sorted before the id (default: the field).
+
+    No count is made in keyset mode unless asked with `count=exact` or `count=approximate`. With `approximate`,
+    unfiltered listings of tables with at least `CATALOG_PAGINATION['APPROXIMATE_COUNT_MIN']` rows
+    take the planner estimate from `pg_class.reltuples` instead of counting, in both modes.
+    """
+
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    count_choices = ('exact', 'approximate')
+    keyset = False
+    count_mode = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count_mode = self.get_count_mode(request)
+        if self.cursor_query_param not in request.query_params:
+            self.keyset = False
+            return super().paginate_queryset(queryset, request, view)
+
+        self.keyset = True
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.count = self.get_count(queryset) if self.count_mode else None
+
+        ordering = self.get_keyset_ordering(request, queryset, view)
+        columns = [(term.lstrip('-'), term.startswith('-')) for term in ordering]
+        queryset = queryset.order_by(*ordering)
+        position = self.decode_cursor(request.query_params[self.cursor_query_param], ordering, queryset.model)
+        if position is not None:
+            queryset = queryset.filter(self.get_keyset_filter(columns, position))
+
+        page = list(queryset[:self.limit + 1])
+        self.next_position = None
+        if len(page) > self.limit:
+            page = page[:self.limit]
+            self.next_position = [self.get_value(page[-1], column) for column, _ in columns]
+        self.ordering = ordering
+        return page
+
+    def get_count_mode(self, request):
+        mode = request.query_params.get(self.count_query_param)
+        return mode if mode in self.count_choices else None
+
+    def get_count(self, queryset):
+        if self.count_mode == 'approximate' and not queryset.query.where:
+            with connections[queryset.db].cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            # -1 - the table was never analyzed
+            if row and row[0] >= settings.CATALOG_PAGINATION['APPROXIMATE_COUNT_MIN']:
+                return int(row[0])
+        return super().get_count(queryset)
+
+    def get_keyset_ordering(self, request, queryset, view):
+        ordering = filters.OrderingFilter().get_ordering(request, queryset, view) or []
+        keyset_fields = getattr(view, 'keyset_ordering_fields', {})
+        keyset_ordering = []
+        for term in ordering:
+            prefix = '-' if term.startswith('-') else ''
+            for column in keyset_fields.get(term.lstrip('-'), [term.lstrip('-')]):
+                keyset_ordering.append(prefix + column)
+        # id tiebreak in the direction of the last term, so an index on (<field>, id) can be scanned either way
+        prefix = '-' if keyset_ordering and keyset_ordering[-1].startswith('-') else ''
+        keyset_ordering.append(prefix + 'pk')
+        return keyset_ordering
+
+    def get_keyset_filter(self, columns, position):
+        # (a, b, c) after (x, y, z): a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+        keyset_filter = Q()
+        equal = Q()
+        for (column, descending), value in zip(columns, position):
+            keyset_filter |= equal & Q(**{f'{column}__{"lt" if descending else "gt"}': value})
+            equal &= Q(**{column: value})
+        # the first column alone narrows the index scan
+        first, descending = columns[0]
+        return Q(**{f'{first}__{"lte" if descending else "gte"}': position[0]}) & keyset_filter
+
+    def get_value(self, instance, column):
+        for attr in column.split('__'):
+            instance = getattr(instance, attr)
+        return instance
+
+    def encode_cursor(self, ordering, position):
+        data = json.dumps([ordering, position], cls=DjangoJSONEncoder)
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def get_field(self, model, column):
+        *relations, name = column.split('__')
+        for relation in relations:
+            model = model._meta.get_field(relation).related_model
+        return model._meta.pk if name == 'pk' else model._meta.get_field(name)
+
+    def decode_cursor(self, cursor, ordering, model):
+        if not cursor:
+            return None
+        try:
+            cursor_ordering, position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            # the ordering changed since the cursor was made
+            if cursor_ordering != ordering or not isinstance(position, list) or len(position) != len(ordering):
+                raise ValueError
+            position = [
+                self.get_field(model, term.lstrip('-')).to_python(value)
+                for term, value in zip(ordering, position)
+            ]
+            if None in position:
+                raise ValueError
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound('Invalid cursor.')
+        return position
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.ordering, self.next_position)
+        )
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        response = {'next': self.get_next_link(), 'results': data}
+        if self.count is not None:
+            response = {'count': self.count, **response}
+        return Response(response)
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Keyset pagination position - empty for the first page, then taken from `next`. '
+                               'Replaces `offset`.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.count_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'exact or approximate (table estimate for large unfiltered listings). '
+                               'Keyset pages are not counted without it.',
+                'schema': {'type': 'string', 'enum': list(self.count_choices)},
+            },
+        ]
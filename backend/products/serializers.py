@@ -1,5 +1,7 @@
 from rest_framework import serializers
 from .models import Category, Product
+from .utils import fetch_thumbnails, get_thumbnail_url
+from .variants import get_variant_urls
 
 class CategorySerializer(serializers.ModelSerializer):
 
@@ -8,12 +10,59 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'name']
 
 
+class ThumbnailField(serializers.Field):
+    """
+    Read-only url of an image's thumbnail - the image url until the thumbnail is generated.
+    """
+
+    def __init__(self, size, **kwargs):
+        self.size = size
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        url = get_thumbnail_url(value, self.size)
+        request = self.context.get('request', None)
+        if url and request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
+class SrcsetField(serializers.Field):
+    """
+    Read-only `srcset` attribute value of an image's responsive variants per format,
+    e.g. `{"webp": "<url> 200w, <url> 400w", "png": ...}` - empty until the variants are generated.
+
+    Takes an image, or the `{extension: [(url, width), ...]}` map returned by get_variant_urls (e.g. from a search document).
+    """
+
+    def to_representation(self, value):
+        variants = value if isinstance(value, dict) else get_variant_urls(value)
+        request = self.context.get('request', None)
+        srcset = {}
+        for extension, urls in variants.items():
+            if request is not None:
+                urls = [(request.build_absolute_uri(url), width) for url, width in urls]
+            srcset[extension] = ', '.join(f'{url} {width}w' for url, width in urls)
+        return srcset
+
+
+class ProductListSerializer(serializers.ListSerializer):
+
+    # load thumbnail metadata of the whole page at once instead of once per product
+    def to_representation(self, data):
+        products = list(data.all() if hasattr(data, 'all') else data)
+        fetch_thumbnails([product.photo for product in products])
+        return super().to_representation(products)
+
+
 class ProductSerializer(serializers.ModelSerializer):
     category_name = serializers.CharField(source='category.name', read_only=True)
-    thumbnail = serializers.ImageField(source='photo.thumbnails.small', read_only=True)
+    thumbnail = ThumbnailField(size='small', source='photo', read_only=True)
+    srcset = SrcsetField(source='photo', read_only=True)
 
     class Meta:
         model = Product
+        list_serializer_class = ProductListSerializer
         fields = [
             'id',
             'name',
@@ -22,6 +71,41 @@ class ProductSerializer(serializers.ModelSerializer):
             'category',
             'category_name',
             'photo',
-            'thumbnail'
+            'thumbnail',
+            'srcset'
         ]
-        
\ No newline at end of file
+
+
+class MediaUrlField(serializers.CharField):
+    """
+    Read-only media url stored as a string (e.g. in a search document), rendered like ImageField urls.
+    """
+
+    def to_representation(self, value):
+        request = self.context.get('request', None)
+        if request is not None:
+            return request.build_absolute_uri(value)
+        return value
+
+
+class CategoryDocumentSerializer(serializers.Serializer):
+    """
+    Serializes CategoryDocument hits - same output as CategorySerializer.
+    """
+    id = serializers.IntegerField(read_only=True)
+    name = serializers.CharField(read_only=True)
+
+
+class ProductDocumentSerializer(serializers.Serializer):
+    """
+    Serializes ProductDocument hits - same output as ProductSerializer.
+    """
+    id = serializers.IntegerField(read_only=True)
+    name = serializers.CharField(read_only=True)
+    description = serializers.CharField(read_only=True)
+    price = serializers.DecimalField(max_digits=9, decimal_places=2, read_only=True)
+    category = serializers.IntegerField(source='category.id', read_only=True)
+    category_name = serializers.CharField(source='category.name', read_only=True)
+    photo = MediaUrlField(read_only=True, allow_null=True)
+    thumbnail = MediaUrlField(read_only=True, allow_null=True)
+    srcset = SrcsetField(read_only=True, default=dict)
@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.db import transaction
+from django_elasticsearch_dsl.apps import DEDConfig
+from django_elasticsearch_dsl.registries import registry
+from django_elasticsearch_dsl.signals import RealTimeSignalProcessor
+
+from . import indexing
+from .models import Category
+from .tasks import flush_search_index, update_category_products
+
+
+class QueuedSignalProcessor(RealTimeSignalProcessor):
+    """
+    Queues saved and deleted rows for indexing by a Celery worker instead of calling Elasticsearch in the request.
+
+    Rows are queued once the transaction commits, so the worker reads the committed data.
+    With `SEARCH_INDEX_QUEUE['ENABLED']` off (e.g. in tests) documents are indexed synchronously,
+    like with the default RealTimeSignalProcessor.
+
+    Category saves also update the category name stored in product documents, in a background task.
+    """
+
+    def handle_save(self, sender, instance, **kwargs):
+        if isinstance(instance, Category) and DEDConfig.autosync_enabled():
+            self.update_category_products(instance)
+        if not settings.SEARCH_INDEX_QUEUE['ENABLED']:
+            return super().handle_save(sender, instance, **kwargs)
+        self.queue(instance)
+
+    def update_category_products(self, category):
+        if not settings.SEARCH_INDEX_QUEUE['ENABLED']:
+            update_category_products.apply(args=(category.pk,), throw=True)
+            return
+        pk = category.pk
+        transaction.on_commit(lambda: update_category_products.delay(pk))
+
+    def handle_delete(self, sender, instance, **kwargs):
+        if not settings.SEARCH_INDEX_QUEUE['ENABLED']:
+            return super().handle_delete(sender, instance, **kwargs)
+        self.queue(instance)
+
+    def queue(self, instance):
+        if not DEDConfig.autosync_enabled() or instance.__class__ not in registry.get_models():
+            return
+        model, pk = instance.__class__, instance.pk
+        transaction.on_commit(lambda: self.queue_on_commit(model, pk))
+
+    def queue_on_commit(self, model, pk):
+        if indexing.enqueue(model, [pk]):
+            flush_search_index.apply_async(countdown=settings.SEARCH_INDEX_QUEUE['COUNTDOWN'])
@@ -0,0 +1,109 @@
+from celery import shared_task
+from django.conf import settings
+from django.utils import timezone
+from django_elasticsearch_dsl.apps import DEDConfig
+from elasticsearch.exceptions import ConnectionError, TransportError
+from elasticsearch.helpers import BulkIndexError
+
+from . import cache as catalog_cache
+from . import indexing
+from .documents import ProductDocument
+from .models import Category, Product
+from .utils import generate_thumbnails
+from .variants import generate_variants
+
+
+@shared_task(bind=True, max_retries=5)
+def flush_search_index(self):
+    """
+    Indexes the rows queued by `QueuedSignalProcessor` with Elasticsearch bulk requests.
+
+    Duplicate saves of a row are already coalesced in the queue, so each row is indexed once per flush.
+    On a cluster error the batch is put back in the queue and the task is retried with exponential backoff.
+    
+    Args:
+        self (celery.Task): The Celery task instance.
+    
+    Returns:
+        str: The number of synced documents and the queue lag - time the oldest of them had waited, in seconds.
+    """
+    try:
+        synced, lag = indexing.flush()
+    except (BulkIndexError, ConnectionError, TransportError) as e:
+        raise self.retry(exc=e, countdown=2 ** self.request.retries)
+    return f'{synced} documents synced, queue lag {lag:.1f}s'
+
+
+@shared_task(bind=True, max_retries=5)
+def update_category_products(self, category_id):
+    """
+    Updates the category name stored in the product documents of the given category.
+
+    The name is read when the task runs, so the index ends up with the latest name
+    even if several renames are processed out of order.
+
+    Args:
+        self (celery.Task): The Celery task instance.
+        category_id (int): The renamed category id.
+
+    Returns:
+        str: The number of updated product documents.
+    """
+    name = Category.objects.filter(pk=category_id).values_list('name', flat=True).first()
+    if name is None:
+        return 'category deleted'
+    try:
+        updated = ProductDocument.update_category_name(category_id, name)
+    except (ConnectionError, TransportError) as e:
+        raise self.retry(exc=e, countdown=2 ** self.request.retries)
+    return f'{updated} product documents updated'
+
+
+def refresh_products(product_ids):
+    """
+    Publishes new thumbnails of the given products - bumps their `updated_at`,
+    invalidates cached catalog responses and reindexes their search documents.
+    """
+    Product.objects.filter(pk__in=product_ids).update(updated_at=timezone.now())
+    catalog_cache.invalidate()
+    if DEDConfig.autosync_enabled():
+        if not settings.SEARCH_INDEX_QUEUE['ENABLED']:
+            indexing.index_batch(Product, product_ids)
+        elif indexing.enqueue(Product, product_ids):
+            flush_search_index.apply_async(countdown=settings.SEARCH_INDEX_QUEUE['COUNTDOWN'])
+
+
+@shared_task(bind=True)
+def generate_product_thumbnails(self, product_ids, sizes=None, force=False, variants=True):
+    """
+    Generates the missing photo thumbnails and responsive variants of the given products, outside the upload request.
+
+    Idempotent - existing thumbnails are kept unless `force` is set, so the task can be retried or run twice.
+    Products with new thumbnails get a new `updated_at`, cached catalog responses are invalidated
+    and search documents are reindexed, so the thumbnail url replaces the original photo url.
+
+    Args:
+        self (celery.Task): The Celery task instance.
+        product_ids (list): Ids of the products.
+        sizes (list, optional): Thumbnail sizes. `PRODUCT_THUMBNAILS['SIZES']` if not provided.
+        force (bool): Regenerate existing thumbnails.
+        variants (bool): Also generate the responsive variants (see products.variants).
+
+    Returns:
+        str: The number of products with generated thumbnails and with missing photo files.
+    """
+    sizes = sizes or settings.PRODUCT_THUMBNAILS['SIZES']
+    updated, missing = [], 0
+    for product in Product.objects.filter(pk__in=product_ids).exclude(photo='').only('photo'):
+        try:
+            generated = generate_thumbnails(product.photo, sizes, force=force)
+            if variants:
+                generated += generate_variants(product.photo, force=force)
+            if generated:
+                updated.append(product.pk)
+        except OSError:
+            # the photo file is missing or not an image
+            missing += 1
+    if updated:
+        refresh_products(updated)
+    return f'{len(updated)} products with new thumbnails, {missing} missing photos'
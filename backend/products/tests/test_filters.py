@@ -0,0 +1,47 @@
+from django.test import RequestFactory, SimpleTestCase
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
+
+from products.documents import CategoryDocument, ProductDocument
+from products.views import CategoryViewSet, ProductViewSet
+
+
+class SearchFiltersTest(SimpleTestCase):
+    """
+    Filters and ordering are translated to the Elasticsearch query - no cluster is needed.
+    """
+
+    def build_search(self, viewset, document, query_string):
+        view = viewset()
+        view.request = Request(RequestFactory().get('/products/' + query_string))
+        view.format_kwarg = None
+        return view.filter_search(document.search()).to_dict()
+
+    def test_product_filters_are_es_filters(self):
+        search = self.build_search(
+            ProductViewSet, ProductDocument, '?search=x&category=3&price__gte=2&price__lte=10.5'
+        )
+        self.assertEqual(search['query']['bool']['filter'], [
+            {'term': {'category.id': '3'}},
+            {'range': {'price': {'gte': 2.0, 'lte': 10.5}}},
+        ])
+
+    def test_product_invalid_filter_not_allowed(self):
+        with self.assertRaises(ValidationError):
+            self.build_search(ProductViewSet, ProductDocument, '?search=x&price__gte=abc')
+
+    def test_product_ordering_is_es_sort(self):
+        search = self.build_search(ProductViewSet, ProductDocument, '?search=x&ordering=-price,category__name')
+        self.assertEqual(search['sort'], [
+            {'price': {'order': 'desc'}},
+            {'category.name.raw': {'order': 'asc'}},
+            {'id': {'order': 'asc'}},
+        ])
+
+    def test_product_invalid_ordering_ignored(self):
+        search = self.build_search(ProductViewSet, ProductDocument, '?search=x&ordering=description')
+        self.assertNotIn('sort', search)
+
+    def test_category_ordering_is_es_sort(self):
+        search = self.build_search(CategoryViewSet, CategoryDocument, '?search=x&ordering=-name')
+        self.assertEqual(search['sort'], [{'name.raw': {'order': 'desc'}}, {'id': {'order': 'asc'}}])
@@ -1,15 +1,40 @@
+import base64
+import csv
+import json
 import shutil
+from datetime import datetime, timedelta
+from io import BytesIO, StringIO
+from urllib.parse import quote
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
 from django.test import override_settings, TestCase
+from django.test.utils import CaptureQueriesContext
 from django.test.client import MULTIPART_CONTENT, encode_multipart, BOUNDARY
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
 from django.contrib.auth.hashers import make_password
+from PIL import Image
 from rest_framework_simplejwt.tokens import RefreshToken
 
 from django.contrib.auth.models import Group, User
+from backend.testing import local_settings
+from products import export
 from products.models import Category, Product
+from products.pagination import KeysetLimitOffsetPagination
+from products.tasks import generate_product_thumbnails
+from products.utils import fetch_thumbnails
+from products.variants import get_variant_urls
+from thumbnails.models import ThumbnailMeta
 
 TEST_DIR = 'test_data'
 
+@local_settings
 class CategoryViewSetTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -43,6 +68,8 @@ class CategoryViewSetTest(TestCase):
         cls.list_url = reverse('category-list')
         cls.detail_url = reverse('category-detail', kwargs={'pk': cls.category.id})
 
+    def setUp(self):
+        cache.clear()
 
     # List tests
     def test_list_url_exists_at_desired_location(self):
@@ -63,6 +90,16 @@ class CategoryViewSetTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.data['results']), 6)
 
+    # Keyset pagination tests
+    def test_keyset_pages(self):
+        url = f'{self.list_url}?cursor=&limit=10&ordering=-name'
+        pks = []
+        while url:
+            response = self.client.get(url)
+            pks += [category['id'] for category in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(pks, list(Category.objects.order_by('-name', '-pk').values_list('pk', flat=True)))
+
     # Detail tests
     def test_detail_url_exists_at_desired_location(self):
         response = self.client.get('/products/categories/', kwargs={'pk': self.category.id})
@@ -169,11 +206,13 @@ class CategoryViewSetTest(TestCase):
         self.assertEqual(response.status_code, 404)
 
 
+@local_settings
 @override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
 class ProductViewSetTest(TestCase):
 
     @classmethod
     def setUp(cls):
+        cache.clear()
         # Create test category
         cls.category = Category.objects.create(name='Product test category')
 
@@ -244,7 +283,242 @@ class ProductViewSetTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.data['results']), 6)
 
+    # Query budget tests - count, products joined with categories, thumbnails metadata
+    def generate_thumbnails(self):
+        # test photos are saved after the product, so thumbnails are created lazily on first access
+        for product in Product.objects.all():
+            product.photo.thumbnails.small
+
+    def test_list_query_count(self):
+        self.generate_thumbnails()
+        with self.assertNumQueries(3):
+            response = self.client.get(self.list_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['category_name'], self.category.name)
+        self.assertTrue(response.data['results'][0]['thumbnail'])
+
+    def test_list_query_count_does_not_depend_on_page_size(self):
+        self.generate_thumbnails()
+        with self.assertNumQueries(3):
+            response = self.client.get(self.list_url+'?limit=100')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 16)
+
+    # Cache tests
+    def test_list_cached(self):
+        self.generate_thumbnails()
+        self.assertEqual(self.client.get(self.list_url + '?limit=5&offset=0')['X-Cache'], 'MISS')
+        # same params in another order
+        with self.assertNumQueries(0):
+            response = self.client.get(self.list_url + '?offset=0&limit=5')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertEqual(self.client.get(self.list_url + '?limit=6')['X-Cache'], 'MISS')
+
+    def test_cache_invalidated_on_product_and_category_save(self):
+        self.client.get(self.list_url)
+        self.client.get(self.detail_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Renamed product'
+            self.product.save()
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['name'], 'Renamed product')
+        self.assertEqual(self.client.get(self.list_url)['X-Cache'], 'MISS')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Renamed category'
+            self.category.save()
+        self.assertEqual(self.client.get(self.detail_url).data['category_name'], 'Renamed category')
+
+    # Conditional request tests
+    def test_list_not_modified(self):
+        response = self.client.get(self.list_url)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertNotEqual(self.client.get(self.list_url + '?limit=5')['ETag'], etag)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_detail_not_modified_since(self):
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response['Last-Modified'], http_date(self.product.updated_at.timestamp()))
+        response = self.client.get(self.detail_url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(self.detail_url, HTTP_IF_MODIFIED_SINCE=http_date(0))
+        self.assertEqual(response.status_code, 200)
+
+    def test_detail_modified_by_category_rename(self):
+        Product.objects.filter(pk=self.product.pk).update(updated_at=timezone.now() - timedelta(days=1))
+        Category.objects.update(updated_at=timezone.now() - timedelta(days=1))
+        last_modified = self.client.get(self.detail_url)['Last-Modified']
+        self.category.name = 'Renamed category'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.save()
+        response = self.client.get(self.detail_url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['category_name'], 'Renamed category')
+        self.assertEqual(response['Last-Modified'], http_date(self.category.updated_at.timestamp()))
+
+    # Export tests
+    def get_export(self, params='', **token):
+        return self.client.get(reverse('product-export') + params, **(token or self.manager_token))
+
+    def test_export_manager_only(self):
+        self.assertEqual(self.client.get(reverse('product-export')).status_code, 401)
+        self.assertEqual(self.get_export(**self.client_token).status_code, 403)
+
+    def test_export_ndjson(self):
+        started = timezone.now()
+        response = self.get_export()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        # products saved by transactions still open when the export started are exported by the next sync
+        overlap = timedelta(seconds=settings.CATALOG_EXPORT['OVERLAP'])
+        updated_until = datetime.fromisoformat(response['X-Updated-Until'])
+        self.assertTrue(started - overlap <= updated_until <= timezone.now() - overlap)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], list(Product.objects.order_by('pk').values_list('pk', flat=True)))
+        self.assertEqual(rows[-1]['category_name'], self.category.name)
+        self.assertTrue(rows[-1]['updated_at'])
+
+    def test_export_csv(self):
+        response = self.get_export('?export_format=csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 16)
+        self.assertEqual(rows[-1]['price'], '15.00')
+        self.assertEqual(json.loads(rows[-1]['srcset']), {})
+
+    def test_export_updated_since(self):
+        since = timezone.now()
+        Product.objects.exclude(pk=self.product.pk).update(updated_at=since - timedelta(days=1))
+        Category.objects.update(updated_at=since - timedelta(days=1))
+        Product.objects.filter(pk=self.product.pk).update(updated_at=since)
+        response = self.get_export(f'?updated_since={quote(since.isoformat())}')
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(row)['id'] for row in rows], [self.product.pk])
+        # a renamed category changes category_name of all its products
+        self.category.save()
+        response = self.get_export(f'?updated_since={since.date()}')
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 16)
+
+    def test_export_updated_since_uses_indexes(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE products_product')
+            cursor.execute('ANALYZE products_category')
+            # a 16 row table is cheaper to scan in pk order - the indexes are used on large tables
+            cursor.execute('SET enable_seqscan = off')
+            cursor.execute('SET enable_indexscan = off')
+        self.addCleanup(lambda: connection.cursor().execute('RESET enable_seqscan; RESET enable_indexscan'))
+        since = timezone.now()
+        self.category.save()
+        plan = export.get_queryset(Product.objects.all(), since).explain()
+        self.assertIn('category_updated_at_idx', Category.objects.filter(updated_at__gte=since).explain())
+        self.assertIn('product_updated_at_idx', plan)
+        # the changed categories are resolved by their own query, the products are not joined with them
+        self.assertNotIn('products_category', plan)
+
+    def test_export_invalid_params(self):
+        self.assertEqual(self.get_export('?export_format=xml').status_code, 400)
+        self.assertEqual(self.get_export('?updated_since=yesterday').status_code, 400)
+
+    # Benchmark - one thumbnail metadata query per chunk, rows are not counted
+    def test_export_query_count(self):
+        for chunk_size, chunks in ((20, 1), (5, 4)):
+            with override_settings(CATALOG_EXPORT={**settings.CATALOG_EXPORT, 'CHUNK_SIZE': chunk_size}):
+                with CaptureQueriesContext(connection) as context:
+                    b''.join(self.get_export().streaming_content)
+            sql = [query['sql'] for query in context.captured_queries]
+            self.assertEqual(len([query for query in sql if 'thumbnails_thumbnailmeta' in query]), chunks)
+            self.assertEqual(len([query for query in sql if 'products_product' in query]), 1)
+            self.assertFalse([query for query in sql if 'COUNT(' in query])
+
+    # Keyset pagination tests
+    def get_keyset_pages(self, params):
+        url = f'{self.list_url}?cursor=&limit=5&{params}'
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([product['id'] for product in response.data['results']])
+            url = response.data['next']
+        return pages
+
+    def test_keyset_pages_follow_ordering(self):
+        pks = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+        # ties are broken by id
+        Product.objects.filter(pk__in=pks[:8]).update(price=1)
+        for params, ordering in [
+            ('', ['pk']),
+            ('ordering=-price', ['-price', '-pk']),
+            ('ordering=name', ['name', 'pk']),
+            ('ordering=category__name,price', ['category__name', 'category_id', 'price', 'pk']),
+        ]:
+            pages = self.get_keyset_pages(params)
+            self.assertEqual([len(page) for page in pages], [5, 5, 5, 1])
+            self.assertEqual(sum(pages, []), list(Product.objects.order_by(*ordering).values_list('pk', flat=True)))
+
+    def test_keyset_count(self):
+        response = self.client.get(self.list_url + '?cursor=')
+        self.assertNotIn('count', response.data)
+        response = self.client.get(self.list_url + '?cursor=&count=exact')
+        self.assertEqual(response.data['count'], 16)
+
+    @override_settings(CATALOG_PAGINATION={'APPROXIMATE_COUNT_MIN': 10})
+    def test_approximate_count(self):
+        Product.objects.filter(pk=self.product.pk).delete()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE products_product')
+        Product.objects.filter(price__gte=10).delete()
+        # the estimate of the last analyze
+        response = self.client.get(self.list_url + '?count=approximate')
+        self.assertEqual(response.data['count'], 15)
+        response = self.client.get(self.list_url + '?cursor=&count=approximate')
+        self.assertEqual(response.data['count'], 15)
+        # filtered listings are counted
+        response = self.client.get(f'{self.list_url}?count=approximate&category={self.category.pk}')
+        self.assertEqual(response.data['count'], 10)
+
+    def test_keyset_invalid_cursor(self):
+        response = self.client.get(self.list_url + '?cursor=&limit=5&ordering=price')
+        self.assertEqual(self.client.get(response.data['next']).status_code, 200)
+        # the ordering changed
+        next_url = response.data['next'].replace('ordering=price', 'ordering=name')
+        self.assertEqual(self.client.get(next_url).status_code, 404)
+        self.assertEqual(self.client.get(self.list_url + '?cursor=abc').status_code, 404)
+        # valid shape, values that are not a price and an id
+        for position in (['abc', 1], [1, 'abc'], 'ab', [None, 1], [[1], 1]):
+            cursor = base64.urlsafe_b64encode(json.dumps([['price', 'pk'], position]).encode()).decode()
+            self.assertEqual(self.client.get(f'{self.list_url}?ordering=price&cursor={cursor}').status_code, 404)
+
+    def test_keyset_page_uses_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE products_product')
+            # a 16 row table is cheaper to sort - the index is read in order on large tables
+            cursor.execute('SET enable_seqscan = off')
+            cursor.execute('SET enable_sort = off')
+        self.addCleanup(lambda: connection.cursor().execute('RESET enable_seqscan; RESET enable_sort'))
+        keyset_filter = KeysetLimitOffsetPagination().get_keyset_filter(
+            [('price', True), ('pk', True)], ['5.00', self.product.pk]
+        )
+        plan = Product.objects.filter(keyset_filter).order_by('-price', '-pk')[:11].explain()
+        self.assertIn('Index Scan Backward using product_price_id_idx', plan)
+        self.assertNotIn('Sort', plan)
+
     # Detail tests
+    def test_detail_query_count(self):
+        self.generate_thumbnails()
+        with self.assertNumQueries(2):
+            response = self.client.get(self.detail_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['thumbnail'])
+
     def test_detail_url_exists_at_desired_location(self):
         response = self.client.get('/products/categories/', kwargs={'pk': self.product.id})
         self.assertEqual(response.status_code, 200)
@@ -307,6 +581,109 @@ class ProductViewSetTest(TestCase):
         self.assertEqual(response.status_code, 201)
         self.assertEqual(response.data['name'], data['name'])
 
+    # Thumbnail tests
+    @override_settings(PRODUCT_THUMBNAILS={**settings.PRODUCT_THUMBNAILS, 'ASYNC': True})
+    @patch('products.images.generate_product_thumbnails.delay')
+    def test_product_create_thumbnail_generated_later(self, delay):
+        f = open('products/tests/images/circle-1000x1000.png', 'rb')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.list_url, data={
+                'name': 'manager product test',
+                'description': 'product test',
+                'price': 6,
+                'category': self.category.id,
+                'photo': f
+            }, **self.manager_token)
+        f.close()
+        self.assertEqual(response.status_code, 201)
+        # the original photo until the thumbnail is generated
+        self.assertEqual(response.data['thumbnail'], response.data['photo'])
+        self.assertEqual(response.data['srcset'], {})
+        delay.assert_called_once_with([response.data['id']])
+        self.assertEqual(
+            generate_product_thumbnails.apply(args=([response.data['id']],)).get(),
+            '1 products with new thumbnails, 0 missing photos'
+        )
+        product = Product.objects.get(pk=response.data['id'])
+        self.assertTrue(product.photo.thumbnails.small)
+        response = self.client.get(reverse('product-detail', kwargs={'pk': product.pk}))
+        self.assertNotEqual(response.data['thumbnail'], response.data['photo'])
+        # idempotent
+        self.assertEqual(
+            generate_product_thumbnails.apply(args=([product.pk],)).get(),
+            '0 products with new thumbnails, 0 missing photos'
+        )
+
+    @patch('products.management.commands.regenerate_thumbnails.generate_product_thumbnails.delay')
+    def test_regenerate_thumbnails_in_chunks(self, delay):
+        call_command('regenerate_thumbnails', '--size', 'small', '--force', '--chunk-size', '10', stdout=StringIO())
+        pks = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+        self.assertEqual(
+            [call.args for call in delay.call_args_list],
+            [(pks[:10], ['small'], True, True), (pks[10:], ['small'], True, True)]
+        )
+        generate_product_thumbnails.apply(args=(pks[:10], ['small'], True, False))
+        self.assertEqual(len({product.photo.thumbnails.small.name for product in Product.objects.all()}), 16)
+
+    def test_backfill_thumbnails(self):
+        pks = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+        # resumed after an interrupted run
+        out = StringIO()
+        call_command('backfill_thumbnails', '--workers', '2', '--chunk-size', '4', '--after', str(pks[9]), stdout=out)
+        self.assertIn('4/6 products', out.getvalue())
+        self.assertIn(f'(last id: {pks[13]})', out.getvalue())
+        self.assertIn('6/6 products', out.getvalue())
+        products = list(Product.objects.order_by('pk'))
+        fetch_thumbnails([product.photo for product in products])
+        self.assertEqual(
+            [bool(product.photo.thumbnails._thumbnails) for product in products],
+            [False] * 10 + [True] * 6
+        )
+        self.assertTrue(get_variant_urls(products[-1].photo)['webp'])
+        # only the missing thumbnails are generated
+        out = StringIO()
+        call_command('backfill_thumbnails', '--workers', '2', stdout=out)
+        self.assertIn('Done, 70 thumbnails generated for 16 products.', out.getvalue())
+        call_command('backfill_thumbnails', '--workers', '2', '--size', 'small', '--force', '--no-variants', stdout=out)
+        self.assertIn('Done, 16 thumbnails generated for 16 products.', out.getvalue())
+        self.assertEqual(ThumbnailMeta.objects.filter(size='small').count(), 16)
+
+    def test_srcset_variants(self):
+        generate_product_thumbnails.apply(args=([self.product.pk],))
+        response = self.client.get(self.detail_url)
+        srcset = response.data['srcset']
+        # avif is skipped if Pillow cannot write it
+        self.assertTrue({'png', 'webp'} <= set(srcset))
+        self.assertRegex(
+            srcset['webp'],
+            r'^http://testserver/\S+_200\.webp 200w, http://testserver/\S+_400\.webp 400w, '
+            r'http://testserver/\S+_800\.webp 800w$'
+        )
+        # one metadata query for the thumbnail and all variants
+        with self.assertNumQueries(3):
+            response = self.client.get(self.list_url + '?ordering=-price&limit=1')
+        self.assertEqual(response.data['results'][0]['srcset'], srcset)
+
+    def test_srcset_narrow_photo(self):
+        photo = BytesIO()
+        Image.new('RGB', (120, 80), 'red').save(photo, format='PNG')
+        self.product.photo.save('narrow-photo.png', ContentFile(photo.getvalue()))
+        generate_product_thumbnails.apply(args=([self.product.pk],))
+        response = self.client.get(self.detail_url)
+        # a single variant, described by the photo's own width - not upscaled to the narrowest configured one
+        self.assertRegex(response.data['srcset']['webp'], r'^http://testserver/\S+_120\.webp 120w$')
+
+    # Benchmark - the 200px webp variant is smaller than the small thumbnail
+    def test_benchmark_thumbnails(self):
+        out = StringIO()
+        call_command('benchmark_thumbnails', '--count', '2', stdout=out)
+        size_bytes = {
+            size.strip(): int(value.split()[0])
+            for size, value in (line.split(':') for line in out.getvalue().splitlines() if 'bytes' in line)
+        }
+        self.assertLess(size_bytes['200_webp'], size_bytes['small'])
+        self.assertIn('all variants generated in', out.getvalue())
+
     def test_product_update_allowed(self):
         f = open('products/tests/images/circle-1000x1000.png', 'rb')
         data = {
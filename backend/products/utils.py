@@ -0,0 +1,90 @@
+from django.db import IntegrityError, transaction
+from thumbnails.backends.metadata import ImageMeta
+from thumbnails.images import Thumbnail
+from thumbnails.models import Source, ThumbnailMeta
+
+
+def fetch_thumbnails(images, sizes=None):
+    """
+    Loads thumbnail metadata for many images in a single query.
+
+    Database backend counterpart of `thumbnails.fields.fetch_thumbnails` (which supports Redis only).
+    Fills each image's thumbnail cache, so reading e.g. `photo.thumbnails.small` afterwards
+    does not query the metadata table once per image.
+
+    Args:
+        images (list): ThumbnailedImageFile instances (e.g. `product.photo`).
+        sizes (list, optional): Thumbnail sizes to load. All sizes are loaded if not provided.
+    """
+    images = [image for image in images if image]
+    if not images:
+        return
+
+    metas = ThumbnailMeta.objects.filter(source__name__in={image.name for image in images})
+    if sizes:
+        metas = metas.filter(size__in=sizes)
+
+    found = {}
+    for source_name, name, size in metas.values_list('source__name', 'name', 'size'):
+        found.setdefault(source_name, []).append(ImageMeta(source_name, name, size))
+
+    for image in images:
+        thumbnails = image.thumbnails
+        # missing sizes fall back to the regular get/create path of ThumbnailManager
+        thumbnails._thumbnails = {
+            meta.size: Thumbnail(metadata=meta, storage=thumbnails.storage)
+            for meta in found.get(image.name, [])
+        }
+
+
+def get_thumbnail_url(image, size):
+    """
+    Returns the url of the image's thumbnail of the given size, or of the image itself until the thumbnail is generated.
+
+    Unlike `image.thumbnails.<size>`, never generates the thumbnail in the calling thread (see generate_thumbnails).
+    """
+    if not image:
+        return None
+    if image.thumbnails._thumbnails is None:
+        # all sizes - responsive variants are read from the same cache
+        fetch_thumbnails([image])
+    thumbnail = image.thumbnails._thumbnails.get(size)
+    return thumbnail.url if thumbnail else image.url
+
+
+def generate_thumbnails(image, sizes, force=False):
+    """
+    Generates the missing thumbnails of an image, or all given sizes with `force`.
+
+    Idempotent and safe to run concurrently for the same image - a thumbnail generated meanwhile
+    by another worker is kept.
+
+    Args:
+        image (ThumbnailedImageFile): The source image (e.g. `product.photo`).
+        sizes (list): Thumbnail sizes to generate.
+        force (bool): Regenerate existing thumbnails.
+
+    Returns:
+        list: The generated sizes.
+    """
+    if not image:
+        return []
+    # registered by ThumbnailedImageFile.save once the upload is stored - not for images assigned by name
+    if not Source.objects.filter(name=image.name).exists():
+        return []
+    fetch_thumbnails([image])
+    generated = []
+    thumbnails = image.thumbnails
+    for size in sizes:
+        if thumbnails._thumbnails.get(size):
+            if not force:
+                continue
+            thumbnails.delete(size)
+        try:
+            with transaction.atomic():
+                thumbnails._thumbnails[size] = thumbnails.create(size)
+        except IntegrityError:
+            # generated by another worker meanwhile
+            continue
+        generated.append(size)
+    return generated
@@ -0,0 +1,192 @@
+"""
+Responsive image variants of product photos.
+
+Each photo is resized to every width of `PRODUCT_THUMBNAILS['VARIANT_WIDTHS']` up to its own width
+(photos narrower than all of them get one variant at their own width) and saved in its own format
+plus every `PRODUCT_THUMBNAILS['VARIANT_FORMATS']` format Pillow can write.
+Variants are stored as regular thumbnails of the photo, sized `<width>_<extension>` (e.g. `400_webp`),
+so they are loaded by `fetch_thumbnails()` and deleted with the photo.
+
+The photo is decoded once per product: JPEG photos are decoded at reduced scale with `draft()`,
+and smaller widths are resized from the previous (bigger) variant with `reduce()` (`thumbnail(reducing_gap=...)`).
+"""
+import io
+import math
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, transaction
+from PIL import ExifTags, Image, ImageOps
+from thumbnails import conf
+from thumbnails.images import Thumbnail
+from thumbnails.models import Source
+
+from .utils import fetch_thumbnails
+
+try:
+    # AVIF plugin for Pillow < 11
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+
+Image.init()
+
+EXTENSIONS = {
+    'JPEG': 'jpg',
+    'PNG': 'png',
+    'GIF': 'gif',
+    'WEBP': 'webp',
+    'AVIF': 'avif',
+}
+
+
+def get_size_name(width, image_format):
+    return f'{width}_{EXTENSIONS[image_format]}'
+
+
+def get_variant_name(source_name, width, image_format):
+    stem = os.path.splitext(source_name)[0]
+    return os.path.join(conf.BASE_DIR, f'{stem}_{width}.{EXTENSIONS[image_format]}')
+
+
+def get_formats(source_format):
+    """
+    Formats the variants of a photo in `source_format` are saved in - formats Pillow cannot write are skipped.
+    """
+    formats = [source_format] if source_format in EXTENSIONS else []
+    for image_format in settings.PRODUCT_THUMBNAILS['VARIANT_FORMATS']:
+        image_format = image_format.upper()
+        if image_format in Image.SAVE and image_format in EXTENSIONS and image_format not in formats:
+            formats.append(image_format)
+    return formats
+
+
+def encode(image, image_format):
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    # ignored by lossless formats
+    image.save(buffer, format=image_format, quality=settings.PRODUCT_THUMBNAILS['QUALITY'])
+    return buffer.getvalue()
+
+
+def get_width(source):
+    """
+    Width of the (not yet decoded) photo once it is rotated by exif_transpose.
+    """
+    rotated = source.getexif().get(ExifTags.Base.Orientation) in (5, 6, 7, 8)
+    return source.height if rotated else source.width
+
+
+def get_widths(source):
+    """
+    Configured variant widths that do not upscale the photo, widest first - or the photo's own width
+    if it is narrower than all of them, so the srcset descriptor matches the variant.
+    """
+    widths = sorted(settings.PRODUCT_THUMBNAILS['VARIANT_WIDTHS'], reverse=True)
+    return [width for width in widths if width <= get_width(source)] or [get_width(source)]
+
+
+def get_missing(source, sizes, force=False):
+    """
+    Returns `{width: [format, ...]}` of the variants of the (not yet decoded) photo missing from `sizes`,
+    or all of them with `force`.
+    """
+    formats = get_formats(source.format)
+    missing = {
+        width: [f for f in formats if force or get_size_name(width, f) not in sizes]
+        for width in get_widths(source)
+    }
+    return {width: image_formats for width, image_formats in missing.items() if image_formats}
+
+
+def resize(source, widths):
+    """
+    Yields `(width, image)` resized to each of the given widths, widest first, decoding the photo once.
+    """
+    widths = sorted(widths, reverse=True)
+    if not widths:
+        return
+    scale = widths[0] / get_width(source)
+    # JPEG only - decode at the smallest scale that still covers the widest variant
+    source.draft(source.mode, (math.ceil(source.width * scale), math.ceil(source.height * scale)))
+    resized = ImageOps.exif_transpose(source)
+    for width in widths:
+        # the previous variant is at least as big - no need to resize the photo again
+        resized = resized.copy()
+        resized.thumbnail((width, resized.height), reducing_gap=2.0)
+        yield width, resized
+
+
+def generate_variants(image, force=False):
+    """
+    Generates the missing variants of an image, or all of them with `force`.
+
+    Like generate_thumbnails, idempotent and safe to run concurrently for the same image.
+
+    Args:
+        image (ThumbnailedImageFile): The source image (e.g. `product.photo`).
+        force (bool): Regenerate existing variants.
+
+    Returns:
+        list: The generated sizes.
+    """
+    if not image:
+        return []
+    if not Source.objects.filter(name=image.name).exists():
+        return []
+    fetch_thumbnails([image])
+    thumbnails = image.thumbnails
+    storage = thumbnails.storage
+    generated = []
+
+    with storage.open(image.name) as file:
+        source = Image.open(file)
+        todo = get_missing(source, thumbnails._thumbnails, force=force)
+        if not todo:
+            return []
+
+        for width, resized in resize(source, todo):
+            for image_format in todo[width]:
+                size = get_size_name(width, image_format)
+                if size in thumbnails._thumbnails:
+                    thumbnails.delete(size)
+                name = storage.save(
+                    get_variant_name(image.name, width, image_format),
+                    ContentFile(encode(resized, image_format)),
+                )
+                try:
+                    with transaction.atomic():
+                        metadata = thumbnails.metadata_backend.add_thumbnail(image.name, size, name)
+                except IntegrityError:
+                    # generated by another worker meanwhile
+                    storage.delete(name)
+                    continue
+                thumbnails._thumbnails[size] = Thumbnail(metadata=metadata, storage=storage)
+                generated.append(size)
+    return generated
+
+
+def get_variant_urls(image):
+    """
+    Returns the urls of the image's generated variants as `{extension: [(url, width), ...]}`, narrowest first.
+
+    Never generates variants - the map is empty until they are generated (see generate_variants).
+    """
+    if not image:
+        return {}
+    if image.thumbnails._thumbnails is None:
+        fetch_thumbnails([image])
+    variants = {}
+    for size, thumbnail in image.thumbnails._thumbnails.items():
+        width, _, extension = size.partition('_')
+        # regular thumbnail sizes, e.g. small
+        if not width.isdigit() or not extension:
+            continue
+        variants.setdefault(extension, []).append((thumbnail.url, int(width)))
+    return {
+        extension: sorted(urls, key=lambda url: url[1])
+        for extension, urls in variants.items()
+    }
@@ -1,4 +1,7 @@
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from rest_framework import filters, permissions, serializers, viewsets
+from rest_framework.decorators import action
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiParameter
 from drf_spectacular.types import OpenApiTypes
@@ -7,8 +10,17 @@ from elasticsearch_dsl import Q
 
 from users.permissions import IsManager
 
+from . import export
+from .cache import CachedReadMixin
+from .filters import SearchFilterBackend, SearchOrderingFilter
 from .models import Category, Product
-from .serializers import CategorySerializer, ProductSerializer
+from .pagination import KeysetLimitOffsetPagination
+from .serializers import (
+    CategoryDocumentSerializer,
+    CategorySerializer,
+    ProductDocumentSerializer,
+    ProductSerializer,
+)
 from .documents import CategoryDocument, ProductDocument
 
 
@@ -22,7 +34,7 @@ from .documents import CategoryDocument, ProductDocument
         ]
     )
 )
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(CachedReadMixin, viewsets.ModelViewSet):
     """
     Viewset for managing category resources.
     
@@ -30,6 +42,10 @@ class CategoryViewSet(viewsets.ModelViewSet):
     
     Ordering:
     - `ordering`: Order categories by `name` (in ascending or descending order).
+
+    Pagination:
+    - `limit`/`offset`, or keyset pages with `cursor` (empty for the first page, then from `next`),
+      see `products.pagination.KeysetLimitOffsetPagination`.
     
     Searching:
     - `search`: Search for categories by name using full-text search.
@@ -40,13 +56,20 @@ class CategoryViewSet(viewsets.ModelViewSet):
     
     Overridden methods:
     - `get_permissions()`: Dynamically sets the permission classes based on the HTTP method.
-    - `get_queryset()`: Applies full-text search on the category data if the `search` query parameter is provided.
+    - `list()`: Serves full-text search results straight from Elasticsearch if the `search` query parameter is provided.
+    - `list()`, `retrieve()`: Other list and detail responses are cached, see `products.cache`.
     """
         
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    pagination_class = KeysetLimitOffsetPagination
     filter_backends = [filters.OrderingFilter]
     ordering_fields = ['name']
+    search_filter_backends = [SearchOrderingFilter]
+    # ordering field -> sortable document field
+    search_ordering_fields = {
+        'name': 'name.raw',
+    }
     
     # require Manager permissions for non-safe methods
     def get_permissions(self):
@@ -55,21 +78,27 @@ class CategoryViewSet(viewsets.ModelViewSet):
                 self.permission_classes = [IsManager]
             return super(CategoryViewSet, self).get_permissions()
     
-    # override queryset - es fulltext search
-    def get_queryset(self):
-        qs = super().get_queryset()
-        if 'search' in self.request.query_params.keys():
-            query =  self.request.query_params['search']
-            q = Q(
-                'multi_match',
-                query=query,
-                fields=['name'],
-                fuzziness='AUTO'
-            )
-            # return 30 items at max
-            search = CategoryDocument.search().query(q)[:30]
-            qs = search.to_queryset()
-        return qs
+    # es fulltext search - results are served from the index, without a database round trip
+    def list(self, request, *args, **kwargs):
+        # search results are not cached - the index is updated after the commit, see products.indexing
+        if 'search' not in request.query_params.keys():
+            return super().list(request, *args, **kwargs)
+        q = Q(
+            'multi_match',
+            query=request.query_params['search'],
+            fields=['name'],
+            fuzziness='AUTO'
+        )
+        search = self.filter_search(CategoryDocument.search().query(q))
+        hits = self.paginator.paginate_search(search, request, view=self)
+        serializer = CategoryDocumentSerializer(hits, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+    # filters/ordering run inside the es query, so a search is a single es call
+    def filter_search(self, search):
+        for backend in self.search_filter_backends:
+            search = backend().filter_search(self.request, search, self)
+        return search
 
 
 
@@ -86,7 +115,7 @@ class CategoryViewSet(viewsets.ModelViewSet):
         ]
     )
 )
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(CachedReadMixin, viewsets.ModelViewSet):
     """
     Viewset for managing product resources.
 
@@ -100,20 +129,27 @@ class ProductViewSet(viewsets.ModelViewSet):
     Ordering:
     - `ordering`: Order products by `category.name`, `name`, or `price` (in ascending or descending order).
 
+    Pagination:
+    - `limit`/`offset`, or keyset pages with `cursor` (empty for the first page, then from `next`),
+      see `products.pagination.KeysetLimitOffsetPagination`.
+
     Searching:
     - `search`: Search for products by name, category name, or description.
 
     Permissions:
-    - `IsManager` permission is required for non-safe HTTP methods (POST, PUT, PATCH, DELETE).
+    - `IsManager` permission is required for non-safe HTTP methods (POST, PUT, PATCH, DELETE) and `export`.
     - `AllowAny` permission is used for safe HTTP methods (GET, HEAD, OPTIONS).
 
     Overridden methods:
-    - `get_permissions()`: Dynamically sets the permission classes based on the HTTP method.
-    - `get_queryset()`: Applies full-text search on the product data if the `search` query parameter is provided.
+    - `get_permissions()`: Dynamically sets the permission classes based on the HTTP method and action.
+    - `list()`: Serves full-text search results straight from Elasticsearch if the `search` query parameter is provided.
+    - `list()`, `retrieve()`: Other list and detail responses are cached, see `products.cache`.
+    - `export()`: Streams the whole catalog as NDJSON or CSV, see `products.export`.
     - `destroy()`: Prevents deletion of a product that has already been sold.
     """
 
-    queryset = Product.objects.all()
+    # category is joined in the same query - ProductSerializer reads category.name
+    queryset = Product.objects.select_related('category')
     serializer_class = ProductSerializer
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter, filters.SearchFilter]
     filterset_fields = {
@@ -121,33 +157,89 @@ class ProductViewSet(viewsets.ModelViewSet):
          'price':['gte', 'lte'],
     }
     ordering_fields = ['category__name', 'name', 'price']
+    pagination_class = KeysetLimitOffsetPagination
+    # products of a category are read through the (category, id) index, categories through (name, id)
+    keyset_ordering_fields = {
+        'category__name': ['category__name', 'category_id'],
+    }
+    search_filter_backends = [SearchFilterBackend, SearchOrderingFilter]
+    # filterset field -> document field
+    search_filter_fields = {
+        'category': 'category.id',
+        'price': 'price',
+    }
+    # ordering field -> sortable document field
+    search_ordering_fields = {
+        'category__name': 'category.name.raw',
+        'name': 'name.raw',
+        'price': 'price',
+    }
 
     # require Manager permissions for non-safe methods
     def get_permissions(self):
             self.permission_classes = [permissions.AllowAny]
-            if self.request.method not in permissions.SAFE_METHODS:
+            if self.request.method not in permissions.SAFE_METHODS or self.action == 'export':
                 self.permission_classes = [IsManager]
             return super(ProductViewSet, self).get_permissions()
     
-    # override queryset - es fulltext search
-    def get_queryset(self):
-        qs = super().get_queryset()
-        if 'search' in self.request.query_params.keys():
-            query =  self.request.query_params['search']
-            q = Q(
-                'multi_match',
-                query=query,
-                fields=[
-                     'name',
-                     'description',
-                     'category.name'
-                ],
-                fuzziness='AUTO'
-            )
-            # return 30 items at max
-            search = ProductDocument.search().query(q)[:30]
-            qs = search.to_queryset()
-        return qs
+    # es fulltext search - results are served from the index, without a database round trip
+    def list(self, request, *args, **kwargs):
+        # search results are not cached - the index is updated after the commit, see products.indexing
+        if 'search' not in request.query_params.keys():
+            return super().list(request, *args, **kwargs)
+        q = Q(
+            'multi_match',
+            query=request.query_params['search'],
+            fields=[
+                 'name',
+                 'description',
+                 'category.name'
+            ],
+            fuzziness='AUTO'
+        )
+        search = self.filter_search(ProductDocument.search().query(q))
+        hits = self.paginator.paginate_search(search, request, view=self)
+        serializer = ProductDocumentSerializer(hits, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+    # filters/ordering run inside the es query, so a search is a single es call
+    def filter_search(self, search):
+        for backend in self.search_filter_backends:
+            search = backend().filter_search(self.request, search, self)
+        return search
+
+    # the response includes category_name - a category rename modifies it
+    def get_last_modified(self, obj):
+        return max(obj.updated_at, obj.category.updated_at)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(name='export_format', description='ndjson (default) or csv.', enum=tuple(export.FORMATS)),
+            OpenApiParameter(
+                name='updated_since',
+                description='Only products changed since this date or datetime (ISO 8601) - '
+                            'e.g. the X-Updated-Until header of the previous export.',
+                type=OpenApiTypes.DATETIME,
+            ),
+        ],
+        responses={(200, content_type): OpenApiTypes.BINARY for content_type in export.FORMATS.values()},
+    )
+    @action(detail=False, methods=['get'], filter_backends=[], pagination_class=None)
+    def export(self, request):
+        export_format = request.query_params.get('export_format', 'ndjson')
+        if export_format not in export.FORMATS:
+            raise serializers.ValidationError({'export_format': f'Choose one of: {", ".join(export.FORMATS)}.'})
+        updated_since = export.parse_updated_since(request.query_params.get('updated_since'))
+        # products saved from (a little before) now on are exported again by the next sync
+        updated_until = export.get_updated_until(timezone.now())
+        queryset = export.get_queryset(self.get_queryset(), updated_since)
+        response = StreamingHttpResponse(
+            export.stream(queryset, export_format, self.get_serializer_context()),
+            content_type=export.FORMATS[export_format],
+        )
+        response['Content-Disposition'] = f'attachment; filename="products.{export_format}"'
+        response['X-Updated-Until'] = updated_until.isoformat()
+        return response
 
     def destroy(self, request, *args, **kwargs):
         product = self.get_object()
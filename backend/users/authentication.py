@@ -0,0 +1,44 @@
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+
+class JWTClaimsAuthentication(JWTAuthentication):
+    """
+    Stateless JWT authentication - builds the user from the access token claims
+    (see users.serializers.ClaimsTokenObtainPairSerializer) instead of loading the User row on every request.
+
+    The user is an unsaved-like user model instance with the id, username, email, names and group names
+    of the token, so it can be assigned to foreign keys (e.g. `CurrentUserDefault`) and read by
+    the permission classes without a query. It must not be saved.
+    Group and name changes apply to tokens obtained afterwards. A deactivated user keeps access until
+    the access token expires - refreshing it is refused (see users.serializers.ClaimsTokenRefreshSerializer),
+    so the stateless mode uses a short ACCESS_TOKEN_LIFETIME.
+    Tokens without the claims (obtained before, or by the default token serializer) are authenticated
+    with a database lookup.
+    """
+
+    def get_user(self, validated_token):
+        # set only by ClaimsTokenObtainPairSerializer
+        if 'is_active' not in validated_token:
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+        if not validated_token['is_active']:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        user = get_user_model()(
+            id=user_id,
+            username=validated_token['username'],
+            email=validated_token['email'],
+            first_name=validated_token['first_name'],
+            last_name=validated_token['last_name'],
+        )
+        # loaded, not new - the instance can be used as a related object
+        user._state.adding = False
+        user._state.db = 'default'
+        # read by users.groups.get_group_names
+        user._group_names = frozenset(validated_token['groups'])
+        return user
@@ -0,0 +1,56 @@
+"""
+Cache of user group names used by the permission classes.
+
+Group names are resolved once per request (stored on the user object) and cached across requests
+per user. Adding or removing groups of a user, renaming or deleting a group invalidates the cached names
+of the affected users.
+"""
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_save, pre_delete
+from django.dispatch import receiver
+
+
+KEY = 'user_groups:{}'
+
+
+def get_group_names(user):
+    if not user.is_authenticated:
+        return frozenset()
+    names = getattr(user, '_group_names', None)
+    if names is None:
+        key = KEY.format(user.pk)
+        names = cache.get(key)
+        if names is None:
+            names = frozenset(user.groups.values_list('name', flat=True))
+            cache.set(key, names, settings.USER_GROUPS_CACHE['TIMEOUT'])
+        user._group_names = names
+    return names
+
+
+def invalidate(user_pks):
+    cache.delete_many([KEY.format(pk) for pk in user_pks])
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_on_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        # user.groups changed
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        # group.user_set changed
+        invalidate(pk_set)
+    elif action == 'pre_clear':
+        # members are unknown once the group is cleared
+        instance._cleared_user_pks = list(instance.user_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        invalidate(instance._cleared_user_pks)
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def invalidate_on_group_change(sender, instance, created=False, **kwargs):
+    if not created:
+        invalidate(instance.user_set.values_list('pk', flat=True))
@@ -1,15 +1,17 @@
 from rest_framework import permissions
 
+from .groups import get_group_names
+
 
 class IsManager(permissions.BasePermission):
 
     def has_permission(self, request, view):
-        if 'manager' in request.user.groups.values_list("name", flat=True):
+        if 'manager' in get_group_names(request.user):
             return True
         return False
 
     def has_object_permission(self, request, view, obj):
-        if 'manager' in request.user.groups.values_list("name", flat=True):
+        if 'manager' in get_group_names(request.user):
             return True
         return False
     
@@ -17,11 +19,11 @@ class IsManager(permissions.BasePermission):
 class IsClient(permissions.BasePermission):
 
     def has_permission(self, request, view):
-        if 'client' in request.user.groups.values_list("name", flat=True):
+        if 'client' in get_group_names(request.user):
             return True
         return False
 
     def has_object_permission(self, request, view, obj):
-        if 'client' in request.user.groups.values_list("name", flat=True):
+        if 'client' in get_group_names(request.user):
             return True
         return False
\ No newline at end of file
@@ -0,0 +1,40 @@
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    Adds the user claims read by `users.authentication.JWTClaimsAuthentication` to obtained tokens.
+
+    Access tokens created by the refresh endpoint copy the claims of the refresh token.
+    """
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['username'] = user.username
+        token['email'] = user.email
+        token['first_name'] = user.first_name
+        token['last_name'] = user.last_name
+        token['groups'] = sorted(user.groups.values_list('name', flat=True))
+        token['is_active'] = user.is_active
+        return token
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Refuses to refresh tokens of deleted or deactivated users - access tokens with claims are not checked
+    against the database, so a deactivated user loses access once the current access token expires.
+    """
+
+    def validate(self, attrs):
+        refresh = RefreshToken(attrs['refresh'])
+        user_id = refresh.get(api_settings.USER_ID_CLAIM)
+        if not get_user_model().objects.filter(
+            **{api_settings.USER_ID_FIELD: user_id, 'is_active': True}
+        ).exists():
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return super().validate(attrs)
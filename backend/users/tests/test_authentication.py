@@ -0,0 +1,107 @@
+from unittest.mock import patch
+
+from django.contrib.auth.models import Group, User
+from django.core import mail
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+
+from backend.testing import local_settings
+from orders.views import CreateOrderAPIView
+from products.models import Category, Product
+from users.authentication import JWTClaimsAuthentication
+from users.permissions import IsClient, IsManager
+from users.serializers import ClaimsTokenObtainPairSerializer
+
+
+@local_settings
+class JWTClaimsAuthenticationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_user = User.objects.create_user(
+            username='Client',
+            email='client@dev.com',
+            first_name='Test',
+            last_name='Client',
+            password='client_pass'
+        )
+        cls.client_user.groups.add(Group.objects.get(name='client'))
+        category = Category.objects.create(name='Stateless auth test category')
+        cls.product = Product.objects.create(
+            name='Test product',
+            description='despription test',
+            price=10,
+            category=category,
+            photo='products/photos/test.png'
+        )
+
+    def obtain_token(self, claims=True, token='access'):
+        # the token views read their serializers from SIMPLE_JWT on import, see JWT_STATELESS_AUTH
+        serializer = 'users.serializers.ClaimsTokenObtainPairSerializer' if claims else TokenObtainPairView._serializer_class
+        with patch.object(TokenObtainPairView, '_serializer_class', serializer):
+            response = self.client.post(reverse('token_obtain_pair'), data={
+                'username': 'Client',
+                'password': 'client_pass',
+            })
+        self.assertEqual(response.status_code, 200)
+        return response.data[token]
+
+    def refresh_token(self, refresh):
+        with patch.object(TokenRefreshView, '_serializer_class', 'users.serializers.ClaimsTokenRefreshSerializer'):
+            return self.client.post(reverse('token_refresh'), data={'refresh': refresh})
+
+    def authenticate(self, token):
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        return JWTClaimsAuthentication().authenticate(request)[0]
+
+    def test_user_built_from_claims(self):
+        token = self.obtain_token()
+        with self.assertNumQueries(0):
+            user = self.authenticate(token)
+            request = RequestFactory().get('/')
+            request.user = user
+            self.assertTrue(IsClient().has_permission(request, None))
+            self.assertFalse(IsManager().has_permission(request, None))
+        self.assertEqual(
+            (user.pk, user.username, user.email, user.first_name, user.last_name),
+            (self.client_user.pk, 'Client', 'client@dev.com', 'Test', 'Client')
+        )
+
+    def test_default_token_without_claims(self):
+        token = AccessToken(self.obtain_token(claims=False))
+        self.assertFalse({'username', 'email', 'first_name', 'last_name', 'groups', 'is_active'} & set(token.payload))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.authenticate(token), self.client_user)
+
+    def test_inactive_user(self):
+        refresh = self.obtain_token(token='refresh')
+        self.assertEqual(self.refresh_token(refresh).status_code, 200)
+        User.objects.filter(pk=self.client_user.pk).update(is_active=False)
+        # refused on refresh - the current access token is not checked against the database
+        self.assertEqual(self.refresh_token(refresh).status_code, 401)
+        token = ClaimsTokenObtainPairSerializer.get_token(User.objects.get(pk=self.client_user.pk)).access_token
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(token)
+
+    def test_token_without_claims_loads_user(self):
+        token = RefreshToken.for_user(self.client_user).access_token
+        with self.assertNumQueries(1):
+            self.assertEqual(self.authenticate(token), self.client_user)
+
+    def test_order_create_without_user_lookup(self):
+        token = self.obtain_token()
+        with patch.object(CreateOrderAPIView, 'authentication_classes', [JWTClaimsAuthentication]):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(reverse('create-order'), data={
+                    'shipment_address': 'Test address',
+                    'order_data': [{'product': self.product.pk, 'quantity': 1}],
+                }, content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['client_email'], 'client@dev.com')
+        self.assertEqual(response.data['client_first_name'], 'Test')
+        self.assertFalse([query for query in queries if 'FROM "auth_' in query['sql']])
+        self.assertEqual(mail.outbox[0].to, ['client@dev.com'])
@@ -0,0 +1,58 @@
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import AnonymousUser, Group, User
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+
+from backend.testing import local_settings
+from users.permissions import IsClient, IsManager
+
+
+@local_settings
+class GroupPermissionTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager_group = Group.objects.get(name='manager')
+        cls.manager_user = User.objects.create_user(
+            username='Manager',
+            email='manager@dev.com',
+            password=make_password('manager_pass')
+        )
+        cls.manager_user.groups.add(cls.manager_group)
+
+    def setUp(self):
+        cache.clear()
+
+    def has_permission(self, permission, user):
+        request = RequestFactory().get('/')
+        # a fresh user object, like the one loaded by the authentication of every request
+        request.user = User.objects.get(pk=user.pk) if user.is_authenticated else user
+        return permission().has_permission(request, None)
+
+    def test_group_names_cached_across_requests(self):
+        request = RequestFactory().get('/')
+        request.user = self.manager_user
+        with self.assertNumQueries(1):
+            self.assertTrue(IsManager().has_permission(request, None))
+            self.assertTrue(IsManager().has_object_permission(request, None, None))
+            self.assertFalse(IsClient().has_permission(request, None))
+        request.user = User.objects.get(pk=self.manager_user.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(IsManager().has_permission(request, None))
+
+    def test_anonymous_user_not_allowed(self):
+        with self.assertNumQueries(0):
+            self.assertFalse(self.has_permission(IsManager, AnonymousUser()))
+
+    def test_cache_invalidated_on_group_change(self):
+        self.assertTrue(self.has_permission(IsManager, self.manager_user))
+        self.manager_user.groups.remove(self.manager_group)
+        self.assertFalse(self.has_permission(IsManager, self.manager_user))
+        self.manager_group.user_set.add(self.manager_user)
+        self.assertTrue(self.has_permission(IsManager, self.manager_user))
+        self.manager_group.user_set.clear()
+        self.assertFalse(self.has_permission(IsManager, self.manager_user))
+        self.manager_user.groups.add(self.manager_group)
+        self.assertTrue(self.has_permission(IsManager, self.manager_user))
+        self.manager_group.name = 'former manager'
+        self.manager_group.save()
+        self.assertFalse(self.has_permission(IsManager, self.manager_user))